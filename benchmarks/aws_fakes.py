@@ -0,0 +1,185 @@
+""" Python script with in-memory stand-ins of the AWS services used by the pipeline Lambda functions: Kinesis, S3, Glue
+and Athena. Only the calls made by the Lambda functions are implemented. install() replaces bootstrap.client and
+bootstrap.resource so that the handlers use the stand-ins without any change.
+"""
+import base64
+import csv
+import io
+import itertools
+import re
+from datetime import datetime, timezone
+
+import bootstrap
+
+
+class FakePaginator:
+    """
+    Class FakePaginator returns pages of a list call, the next page is requested with NextContinuationToken of the
+    previous page while it is truncated.
+    """
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        page = self.method(**kwargs)
+        yield page
+        while page.get("IsTruncated"):
+            page = self.method(**kwargs, ContinuationToken=page["NextContinuationToken"])
+            yield page
+
+
+class FakeKinesis:
+    """
+    Class FakeKinesis keeps records of a single shard stream in memory.
+    """
+    def __init__(self):
+        self.records = []
+        self.streams = set()
+        self._sequence = itertools.count(49590338271490256608559692538361571095921575989136588898)
+
+    def create_stream(self, StreamName, ShardCount=1):
+        self.streams.add(StreamName)
+
+    def describe_stream_summary(self, StreamName):
+        return {"StreamDescriptionSummary": {"StreamStatus": "ACTIVE", "OpenShardCount": 1}}
+
+    def put_record(self, Data, StreamName, PartitionKey):
+        sequence_number = str(next(self._sequence))
+        self.records.append({"Data": Data, "SequenceNumber": sequence_number, "PartitionKey": PartitionKey,
+                             "ApproximateArrivalTimestamp": datetime.now(tz=timezone.utc)})
+        return {"ShardId": "shardId-000000000000", "SequenceNumber": sequence_number}
+
+    def event_batches(self, batch_size=100):
+        """ function that converts stored records into Kinesis event source mapping events
+        :param batch_size: max number of records in an event
+        :return: generator of events
+        """
+        for i in range(0, len(self.records), batch_size):
+            yield {"Records": [{
+                "kinesis": {"partitionKey": r["PartitionKey"],
+                            "sequenceNumber": r["SequenceNumber"],
+                            "data": base64.b64encode(r["Data"]).decode("ascii"),
+                            "approximateArrivalTimestamp": r["ApproximateArrivalTimestamp"].timestamp()},
+                "eventSource": "aws:kinesis",
+                "eventID": "shardId-000000000000:" + r["SequenceNumber"]} for r in self.records[i:i + batch_size]]}
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3:
+    """
+    Class FakeS3 keeps objects in memory, it provides both client calls and resource Object().put() call.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def put_object(self, Bucket, Key, Body):
+        data = Body.encode("utf-8") if isinstance(Body, str) else Body
+        self.bytes_written += len(data)
+        self.objects[(Bucket, Key)] = (data, datetime.now(tz=timezone.utc))
+        return {}
+
+    def get_object(self, Bucket, Key):
+        data = self.objects[(Bucket, Key)][0]
+        self.bytes_read += len(data)
+        return {"Body": FakeBody(data), "ContentLength": len(data)}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+        return {"Deleted": Delete["Objects"]}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None):
+        # like S3, a response has at most MaxKeys keys and no Contents when nothing is found
+        contents = [{"Key": k, "LastModified": modified, "Size": len(data)}
+                    for (b, k), (data, modified) in sorted(self.objects.items()) if b == Bucket and k.startswith(Prefix)]
+        start = int(ContinuationToken or 0)
+        response = {"IsTruncated": start + MaxKeys < len(contents), "KeyCount": len(contents[start:start + MaxKeys])}
+        if contents[start:start + MaxKeys]:
+            response["Contents"] = contents[start:start + MaxKeys]
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name))
+
+    def Object(self, bucket, key):
+        s3 = self
+
+        class _Object:
+            def put(self, Body):
+                return s3.put_object(Bucket=bucket, Key=key, Body=Body)
+        return _Object()
+
+    def keys(self, bucket, prefix):
+        return [k for (b, k) in sorted(self.objects) if b == bucket and k.startswith(prefix)]
+
+
+class FakeGlue:
+    """
+    Class FakeGlue returns table schemas from a dictionary of (database, table) and (columns, partition keys).
+    """
+    def __init__(self, tables):
+        self.tables = tables
+
+    def get_table(self, CatalogId, DatabaseName, Name):
+        columns, partitions = self.tables[(DatabaseName, Name)]
+        return {"Table": {"StorageDescriptor": {"Columns": [{"Name": c} for c in columns]},
+                          "PartitionKeys": [{"Name": c} for c in partitions]}}
+
+
+class FakeAthena:
+    """
+    Class FakeAthena runs the queries of the pipeline against csv objects of FakeS3. Tables are mapped to S3 locations,
+    COUNT queries count rows of the table objects, INSERT queries are recorded, every query succeeds immediately.
+    """
+    def __init__(self, s3, bucket, locations):
+        self.s3 = s3
+        self.bucket = bucket
+        self.locations = locations
+        self.executions = {}
+        self.bytes_scanned = 0
+        self._ids = itertools.count(1)
+
+    def _count_rows(self, table):
+        rows = 0
+        for key in self.s3.keys(self.bucket, self.locations.get(table, table)):
+            data = self.s3.objects[(self.bucket, key)][0]
+            self.bytes_scanned += len(data)
+            rows += sum(1 for _ in csv.reader(io.StringIO(data.decode("utf-8"))))
+        return rows
+
+    def start_query_execution(self, QueryString, QueryExecutionContext, ResultConfiguration):
+        execution_id = str(next(self._ids))
+        match = re.search(r"COUNT\(.*\)\s+AS\s+count\s+FROM\s+(\S+)", QueryString, flags=re.IGNORECASE)
+        result = [["count"], [str(self._count_rows(match.group(1)))]] if match else [[]]
+        self.executions[execution_id] = {"query": QueryString, "result": result}
+        return {"QueryExecutionId": execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {"QueryExecution": {"Status": {"State": "SUCCEEDED", "StateChangeReason": ""},
+                                   "Statistics": {"DataScannedInBytes": 0}}}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000):
+        rows = self.executions[QueryExecutionId]["result"][:MaxResults]
+        return {"ResultSet": {"Rows": [{"Data": [{"VarCharValue": v} for v in row]} for row in rows]}}
+
+
+def install(services):
+    """ function that makes bootstrap return stand-ins instead of boto3 clients and resources. It takes input
+    :param services: dictionary of service name and stand-in object
+    :return: None
+    """
+    def client(service_name, region_name=None, max_attempts=None):
+        return services[service_name]
+    bootstrap.client = client
+    bootstrap.resource = client
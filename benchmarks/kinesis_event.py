@@ -0,0 +1,83 @@
+""" Python script that generates synthetic Kinesis event source mapping payloads for local runs of
+kinesis-consumer-s3 event_source_handler. Records carry tweet data in the format MyStreamListener puts into the stream.
+Invalid records can be mixed in to exercise skipping of malformed records, eg.
+    python benchmarks/kinesis_event.py --records 500 --invalid 2 --window > event.json
+"""
+import argparse
+import base64
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+HASHTAGS = ["news", "covid19", "music", "BTS", "NFL", "election", "crypto", "AI", "travel", "food"]
+WORDS = ["great", "bad", "amazing", "terrible", "today", "new", "love", "hate", "game", "world", "vote", "live"]
+
+
+def make_tweet(rnd, index):
+    """ function that generates tweet record dictionary
+    :param rnd: random number generator
+    :param index: record index used in tweet id
+    :return: dictionary with tweet data
+    """
+    created = datetime(2020, 9, 1, tzinfo=timezone.utc) + timedelta(seconds=rnd.randint(0, 86400))
+    return {"created": created.strftime("%Y-%m-%d %H:%M:%S+00:00"),
+            "tweet_id": str(1300000000000000000 + index),
+            "user_name": f"user_{rnd.randint(1, 1000)}",
+            "rt_count": rnd.randint(100, 50000),
+            "hashtags": ' '.join(rnd.sample(HASHTAGS, rnd.randint(1, 3))),
+            "text": ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 25)))}
+
+
+def make_event(records=100, invalid=0, seed=0, shard_id="shardId-000000000000", window=False):
+    """ function that generates Kinesis event source mapping event. It takes input
+    :param records: number of records in the batch
+    :param invalid: number of records with data that is not valid json
+    :param seed: random generator seed
+    :param shard_id: id of the shard records are coming from
+    :param window: if True tumbling window keys are added to the event
+    :return: dictionary with the event
+    """
+    rnd = random.Random(seed)
+    bad = set(rnd.sample(range(records), min(invalid, records)))
+    now = time.time()
+    event_records = []
+    for i in range(records):
+        data = "{not json" if i in bad else json.dumps(make_tweet(rnd, i))
+        sequence_number = str(49590338271490256608559692538361571095921575989136588898 + i)
+        event_records.append({
+            "kinesis": {"kinesisSchemaVersion": "1.0",
+                        "partitionKey": "111",
+                        "sequenceNumber": sequence_number,
+                        "data": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+                        "approximateArrivalTimestamp": now + i / 1000},
+            "eventSource": "aws:kinesis",
+            "eventVersion": "1.0",
+            "eventID": f"{shard_id}:{sequence_number}",
+            "eventName": "aws:kinesis:record",
+            "awsRegion": "eu-west-1",
+            "eventSourceARN": "arn:aws:kinesis:eu-west-1:123456789012:stream/tweet-stream"})
+    event = {"Records": event_records}
+    if window:
+        start = datetime.fromtimestamp(now, tz=timezone.utc).replace(microsecond=0)
+        event.update({"window": {"start": start.isoformat(), "end": (start + timedelta(seconds=60)).isoformat()},
+                      "state": {},
+                      "shardId": shard_id,
+                      "eventSourceARN": event_records[0]["eventSourceARN"] if event_records else "",
+                      "isFinalInvokeForWindow": False,
+                      "isWindowTerminatedEarly": False})
+    return event
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="synthetic Kinesis event source mapping event generator")
+    arg_parser.add_argument('--records', type=int, default=100)
+    arg_parser.add_argument('--invalid', type=int, default=0)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--window', action='store_true', help="add tumbling window keys")
+    args = arg_parser.parse_args()
+    print(json.dumps(make_event(args.records, args.invalid, args.seed, window=args.window)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+""" Python script that runs the whole pipeline locally on synthetic data and reports performance of every stage.
+Synthetic statuses go through MyStreamListener into in-memory Kinesis, then through kinesis-consumer-s3 event source
+handler into in-memory S3 Landing zone, staging-transform Lambda writes Staging zone and analytical-transform Lambda
+runs its Athena queries against in-memory Athena. With --staging-slices the Staging zone is written by fan-out
+plan, worker and merge steps of staging-transform run in-process instead of its single invocation. For every stage the report contains records in and out, throughput,
+call latency percentiles and peak traced memory. Report can be saved as baseline and compared with a stored baseline,
+the script exits with status 1 when a stage is slower or uses more memory than the baseline allows. The report is the
+only output on stdout, logs of the handlers are printed to stderr, eg.
+    python benchmarks/pipeline_benchmark.py --statuses 20000 --save-baseline benchmarks/baseline.json
+    python benchmarks/pipeline_benchmark.py --statuses 20000 --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from transform_scaling import LAMBDA_DIR, LANDING_COLS, STAGING_COLS, load_handler
+
+sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+import aws_fakes
+import synthetic_tweets
+
+BUCKET = "tweet-etl"
+ENVIRONMENT = {
+    "MY_AWS_REGION": "eu-west-1", "ACCOUNT_ID": "123456789012", "STREAM_NAME": "tweet-stream",
+    "BUCKET_NAME": BUCKET, "FILE_NAME": "tweets", "TIME_ZONE": "UTC", "RUN_SECONDS": "0",
+    "TWEET_COLS": "record_id,timestamp,tweet_data",
+    "SOURCE_DB": "landing", "LANDING_PATH": "landing/", "STAGING_PATH": "staging/hashtags_proc/",
+    "STAGING_FILE": "hashtags_proc", "TIME_HORIZONT_HRS": "24", "ATHENA_OUT": "s3://tweet-etl/athena-out/",
+}
+# staging-transform and analytical-transform use the same variable names for different tables
+STAGING_ENVIRONMENT = {"SOURCE_TABLE": "tweets", "TARGET_DB": "staging", "TARGET_TABLE": "hashtags_proc"}
+ANALYTICAL_ENVIRONMENT = {"SOURCE_TABLE": "staging.hashtags_proc", "TARGET_DB": "analytical",
+                          "TARGET_TABLE": "analytical.hashtag_data"}
+
+
+def percentiles(values, points=(50, 95, 99)):
+    # nearest rank percentiles of the values, in milliseconds
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {f"p{p}_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 3) for p in points}
+
+
+class Stage:
+    """
+    Class Stage measures a single pipeline stage: wall time, latency of each call and peak traced memory.
+    """
+    def __init__(self, name, trace_memory):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self.records_in = 0
+        self.records_out = 0
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def call(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.start
+        self.peak_memory = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def report(self):
+        result = {"records_in": self.records_in, "records_out": self.records_out, "calls": len(self.latencies),
+                  "seconds": round(self.seconds, 3),
+                  "records_per_sec": round(self.records_in / self.seconds, 1) if self.seconds else None}
+        result.update(percentiles(self.latencies))
+        if self.peak_memory is not None:
+            result["peak_memory_bytes"] = self.peak_memory
+        return result
+
+
+def run_pipeline(statuses, seed, batch_size, trace_memory, staging_slices=0):
+    """ function that runs all pipeline stages on synthetic data. It takes input
+    :param statuses: number of synthetic statuses
+    :param seed: random generator seed
+    :param batch_size: number of records in Kinesis event source mapping batch
+    :param trace_memory: if True peak memory of every stage is traced
+    :param staging_slices: number of fan-out worker slices of staging transform, 0 for single invocation
+    :return: tuple of dictionary with stage reports and dictionary with S3 totals
+    """
+    os.environ.update(ENVIRONMENT)
+    kinesis, s3 = aws_fakes.FakeKinesis(), aws_fakes.FakeS3()
+    glue = aws_fakes.FakeGlue({
+        ("landing", "tweets"): (LANDING_COLS, []),
+        ("staging", "hashtags_proc"): (STAGING_COLS[:-3], STAGING_COLS[-3:]),
+    })
+    athena = aws_fakes.FakeAthena(s3, BUCKET, {"staging.hashtags_proc": ENVIRONMENT["STAGING_PATH"]})
+    aws_fakes.install({"kinesis": kinesis, "s3": s3, "glue": glue, "athena": athena})
+
+    import stream_listener
+    consumer = load_handler('kinesis-consumer-s3')
+    staging = load_handler('staging-transform')
+    analytical = load_handler('analytical-transform')
+
+    stream = synthetic_tweets.SyntheticStream(seed)
+    api = SimpleNamespace(me=lambda: None)
+    report = {}
+
+    with Stage("stream_listener", trace_memory) as stage:
+        listener = stream_listener.MyStreamListener(api, 10 ** 9, kinesis, ENVIRONMENT["STREAM_NAME"])
+        for status in stream.statuses(statuses):
+            stage.call(listener.on_status, status)
+        stage.records_in, stage.records_out = statuses, len(kinesis.records)
+    report["stream_listener"] = stage.report()
+
+    with Stage("consumer", trace_memory) as stage:
+        for event in kinesis.event_batches(batch_size):
+            response = stage.call(consumer.event_source_handler, event, None)
+            stage.records_in += len(event["Records"])
+            stage.records_out += len(event["Records"]) - len(response["batchItemFailures"])
+    report["consumer"] = stage.report()
+
+    os.environ.update(STAGING_ENVIRONMENT)
+    with Stage("staging_transform", trace_memory) as stage:
+        stage.records_in = report["consumer"]["records_out"]
+        if staging_slices:
+            log_record = stage.call(staging.fanout_handler, {"action": "local", "workers": staging_slices}, None)
+        else:
+            log_record = stage.call(staging.lambda_handler, {}, None)
+        stage.records_out = int(log_record.split(",")[2])
+    report["staging_transform"] = stage.report()
+
+    os.environ.update(ANALYTICAL_ENVIRONMENT)
+    with Stage("analytical_load", trace_memory) as stage:
+        log_record = stage.call(analytical.lambda_handler, {}, None)
+        stage.records_in = stage.records_out = int(log_record.split(",")[2])
+    report["analytical_load"] = stage.report()
+    report["analytical_load"]["athena_bytes_scanned"] = athena.bytes_scanned
+    totals = {"s3_bytes_written": s3.bytes_written, "s3_bytes_read": s3.bytes_read, "s3_objects": len(s3.objects)}
+    return report, totals
+
+
+def compare(report, baseline, tolerance):
+    """ function that compares stage reports with baseline. Throughput may not drop and p95 latency and peak memory
+    may not grow by more than tolerance share of the baseline value. It takes input
+    :param report: dictionary with stage reports
+    :param baseline: dictionary with baseline stage reports
+    :param tolerance: allowed relative change, eg. 0.2
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        current = report["stages"].get(stage)
+        if current is None:
+            continue
+        checks = [("records_per_sec", -1), ("p95_ms", 1), ("peak_memory_bytes", 1)]
+        for metric, direction in checks:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                regressions.append({"stage": stage, "metric": metric, "baseline": old, "current": new,
+                                    "change": round(change, 3)})
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="end-to-end pipeline benchmark on synthetic data")
+    arg_parser.add_argument('--statuses', type=int, default=20000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--batch-size', type=int, default=100)
+    arg_parser.add_argument('--no-memory', action='store_true', help="do not trace memory, tracing slows stages down")
+    arg_parser.add_argument('--staging-slices', type=int, default=0, help="run staging transform as fan-out")
+    arg_parser.add_argument('--baseline', help="baseline json file to compare the report with")
+    arg_parser.add_argument('--tolerance', type=float, default=0.2)
+    arg_parser.add_argument('--save-baseline', help="path to save the report as baseline")
+    args = arg_parser.parse_args()
+
+    # handlers print their logs to stdout, they are sent to stderr so that stdout only has the json report
+    with contextlib.redirect_stdout(sys.stderr):
+        stages, totals = run_pipeline(args.statuses, args.seed, args.batch_size, not args.no_memory,
+                                      args.staging_slices)
+    report = {"statuses": args.statuses, "seed": args.seed, "batch_size": args.batch_size,
+              "staging_slices": args.staging_slices,
+              "stages": stages, "totals": totals}
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        status = 1 if report["regressions"] else 0
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
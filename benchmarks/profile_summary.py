@@ -0,0 +1,119 @@
+""" Python script that summarises profiling reports written by lambda/profiling.py. CPU profiles (.pstats) of all
+collected invocations are merged and the hottest functions are printed, allocation reports (.alloc.json) are merged by
+allocation site. Reports are read from local files and directories or from S3 prefixes, eg.
+    python benchmarks/profile_summary.py /tmp/profiles --sort tottime --top 30
+    python benchmarks/profile_summary.py s3://tweet-etl/profiles/staging --match staging-transform
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import pstats
+import tempfile
+
+import boto3
+
+
+def download_s3_prefix(path, target_dir):
+    """ function that downloads profiling reports under S3 prefix to a local directory. It takes input
+    :param path: 's3://bucket/prefix' string
+    :param target_dir: local directory
+    :return: list of local file paths
+    """
+    bucket, _, prefix = path[len('s3://'):].partition('/')
+    client = boto3.client('s3')
+    files = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(('.pstats', '.alloc.json')):
+                local_path = os.path.join(target_dir, os.path.basename(obj['Key']))
+                client.download_file(bucket, obj['Key'], local_path)
+                files.append(local_path)
+    return files
+
+
+def collect_files(paths, target_dir):
+    # local file paths of the reports found under the given files, directories and S3 prefixes
+    files = []
+    for path in paths:
+        if path.startswith('s3://'):
+            files += download_s3_prefix(path, target_dir)
+        elif os.path.isdir(path):
+            files += glob.glob(os.path.join(path, '**', '*.pstats'), recursive=True)
+            files += glob.glob(os.path.join(path, '**', '*.alloc.json'), recursive=True)
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def summarise_cpu(files, sort, top):
+    """ function that merges CPU profiles and formats the hottest functions. It takes input
+    :param files: list of .pstats file paths
+    :param sort: pstats sort key, eg. 'cumulative' or 'tottime'
+    :param top: number of functions to print
+    :return: formatted statistics string
+    """
+    stream = io.StringIO()
+    stats = pstats.Stats(files[0], stream=stream)
+    for file in files[1:]:
+        stats.add(file)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return stream.getvalue()
+
+
+def summarise_memory(files, top):
+    """ function that merges allocation reports by allocation site. It takes input
+    :param files: list of .alloc.json file paths
+    :param top: number of allocation sites to return
+    :return: dictionary with peak memory percentiles and top allocation sites
+    """
+    peaks = []
+    sites = {}
+    for file in files:
+        with open(file) as f:
+            report = json.load(f)
+        peaks.append(report["peak_bytes"])
+        for site in report["top"]:
+            total = sites.setdefault(site["location"], {"location": site["location"], "size_bytes": 0, "count": 0,
+                                                        "reports": 0})
+            total["size_bytes"] += site["size_bytes"]
+            total["count"] += site["count"]
+            total["reports"] += 1
+    peaks.sort()
+    return {
+        "reports": len(files),
+        "peak_bytes_max": peaks[-1] if peaks else None,
+        "peak_bytes_median": peaks[len(peaks) // 2] if peaks else None,
+        "top": sorted(sites.values(), key=lambda s: -s["size_bytes"])[:top],
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="summary of collected Lambda profiling reports")
+    arg_parser.add_argument('paths', nargs='+', help="report files, directories or s3://bucket/prefix")
+    arg_parser.add_argument('--sort', default='cumulative', help="pstats sort key, eg. cumulative, tottime, ncalls")
+    arg_parser.add_argument('--top', type=int, default=25)
+    arg_parser.add_argument('--match', help="only use reports whose file name contains this string, eg. handler name")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as target_dir:
+        files = collect_files(args.paths, target_dir)
+        if args.match:
+            files = [f for f in files if args.match in os.path.basename(f)]
+        cpu_files = [f for f in files if f.endswith('.pstats')]
+        memory_files = [f for f in files if f.endswith('.alloc.json')]
+        if not files:
+            print("No profiling reports found")
+            return
+        if cpu_files:
+            print(f"CPU profile of {len(cpu_files)} invocations")
+            print(summarise_cpu(cpu_files, args.sort, args.top))
+        if memory_files:
+            print(f"Allocations of {len(memory_files)} invocations")
+            print(json.dumps(summarise_memory(memory_files, args.top), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+""" Python script that measures cold start cost of the Lambda functions of the project. Each handler module is loaded in
+a fresh Python process, so module import time is measured from a cold interpreter, then lambda_handler is optionally invoked
+twice with a sample event to measure first (cold) and second (warm) invocation latency. Results are printed as json.
+Handlers read their configuration from environmental variables (or DynamoDB through config_provider), so they have to be
+set before running the benchmark, eg.
+    python benchmarks/startup_benchmark.py --handler staging-transform --event events/staging.json
+Invocations call AWS services, AWS_ENDPOINT_URL can be used to point them to local service stand-ins.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lambda')
+
+# code executed in a fresh interpreter for every handler, it prints a single json line with measurements
+PROBE = """
+import importlib.util, json, sys, time
+sys.path.insert(0, {lambda_dir!r})
+result = {{"handler": {name!r}}}
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("handler", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+result["import_seconds"] = round(time.perf_counter() - start, 4)
+event = {event!r}
+if event is not None:
+    for label in ("first_invocation_seconds", "second_invocation_seconds"):
+        start = time.perf_counter()
+        try:
+            module.lambda_handler(json.loads(event), None)
+        except Exception as e:
+            result["error"] = f"{{type(e).__name__}}: {{e}}"
+            break
+        result[label] = round(time.perf_counter() - start, 4)
+print("BENCHMARK_RESULT " + json.dumps(result))
+"""
+
+
+def list_handlers():
+    """ function that returns names of all Lambda handler scripts, shared modules are skipped
+    :return: list of handler names without .py extension
+    """
+    return sorted(f[:-3] for f in os.listdir(LAMBDA_DIR) if f.endswith('.py') and '-' in f)
+
+
+def run_probe(name, event=None):
+    """ function that loads handler module in a new Python process and collects its measurements. It takes input
+    :param name: handler name without .py extension
+    :param event: string with json event to invoke lambda_handler with, handler is only imported if not provided
+    :return: dictionary with measurements
+    """
+    path = os.path.abspath(os.path.join(LAMBDA_DIR, name + '.py'))
+    code = PROBE.format(lambda_dir=os.path.abspath(LAMBDA_DIR), name=name, path=path, event=event)
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('BENCHMARK_RESULT '):
+            return json.loads(line[len('BENCHMARK_RESULT '):])
+    return {"handler": name, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "no result"}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Lambda handler import time and first invocation latency benchmark")
+    arg_parser.add_argument('--handler', action='append', help="handler name, eg. staging-transform (default: all)")
+    arg_parser.add_argument('--event', help="path to json event file used to invoke the handler")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="number of cold processes per handler")
+    args = arg_parser.parse_args()
+
+    event = None
+    if args.event:
+        with open(args.event) as f:
+            event = f.read()
+
+    report = []
+    for name in args.handler or list_handlers():
+        runs = [run_probe(name, event) for _ in range(args.repeat)]
+        summary = {"handler": name, "runs": runs}
+        imports = [r["import_seconds"] for r in runs if "import_seconds" in r]
+        if imports:
+            summary["import_seconds_min"] = min(imports)
+        firsts = [r["first_invocation_seconds"] for r in runs if "first_invocation_seconds" in r]
+        if firsts:
+            summary["first_invocation_seconds_min"] = min(firsts)
+        report.append(summary)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
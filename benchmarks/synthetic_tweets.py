@@ -0,0 +1,88 @@
+""" Python script that generates seeded synthetic Twitter statuses in the shape of tweepy Status objects used by
+MyStreamListener. Generated stream resembles the sample stream the pipeline consumes:
+    - most statuses are retweets of a limited pool of original tweets, popular originals are retweeted many times
+    - hashtag popularity follows Zipf distribution
+    - tweet texts contain emoji, URLs, mentions, '&amp;' entities and line breaks
+    - part of the statuses are not retweets, are not in English or have less than 100 retweets and are filtered out
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+WORDS = ["great", "bad", "amazing", "terrible", "today", "new", "love", "hate", "game", "world", "vote", "live",
+         "happy", "sad", "best", "worst", "news", "breaking", "people", "time", "never", "always", "watch", "thanks"]
+EMOJI = ["\U0001F600", "\U0001F602", "\U0001F525", "\U0001F64F", "\U0001F680", "❤️", "\U0001F1FA\U0001F1F8",
+         "✅", "\U0001F44D", "\U0001F62D"]
+
+
+def zipf_weights(n, s=1.1):
+    # Zipf distribution weights of n ranks
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+class SyntheticStream:
+    """
+    Class SyntheticStream generates statuses from a seeded random generator, the same seed always gives the same stream.
+    """
+    def __init__(self, seed=0, hashtags=5000, originals=2000, retweet_share=0.8, english_share=0.7):
+        """ Class constructor, defines class parameters
+        :param seed: random generator seed
+        :param hashtags: size of hashtag vocabulary
+        :param originals: size of the pool of original tweets that are retweeted
+        :param retweet_share: share of statuses that are retweets
+        :param english_share: share of original tweets in English
+        """
+        self.rnd = random.Random(seed)
+        self.hashtags = [f"tag{i}" for i in range(hashtags)]
+        self.hashtag_weights = zipf_weights(hashtags)
+        self.retweet_share = retweet_share
+        self.english_share = english_share
+        self.start = datetime(2020, 9, 1, 8, 0, 0)
+        self.originals = [self._make_original(i) for i in range(originals)]
+        self.original_weights = zipf_weights(originals, 0.9)
+
+    def _make_text(self, hashtags):
+        rnd = self.rnd
+        parts = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 30))]
+        for _ in range(rnd.randint(0, 4)):
+            parts.insert(rnd.randrange(len(parts) + 1), rnd.choice(EMOJI))
+        if rnd.random() < 0.6:
+            parts.append(f"https://t.co/{rnd.getrandbits(40):010x}")
+        if rnd.random() < 0.3:
+            parts.insert(0, f"@user{rnd.randint(1, 500)}")
+        if rnd.random() < 0.2:
+            parts.insert(rnd.randrange(len(parts) + 1), "&amp;")
+        if rnd.random() < 0.2:
+            parts.insert(rnd.randrange(len(parts) + 1), "\n")
+        parts += ["#" + h for h in hashtags]
+        return ' '.join(parts)
+
+    def _make_original(self, index):
+        rnd = self.rnd
+        tags = list(dict.fromkeys(rnd.choices(self.hashtags, self.hashtag_weights, k=rnd.choice([0, 1, 1, 2, 3]))))
+        text = self._make_text(tags)
+        extended = rnd.random() < 0.5
+        return SimpleNamespace(
+            id_str=str(1300000000000000000 + index),
+            created_at=self.start - timedelta(seconds=rnd.randint(0, 86400)),
+            lang="en" if rnd.random() < self.english_share else rnd.choice(["es", "ja", "pt", "ar"]),
+            user=SimpleNamespace(screen_name=f"user{rnd.randint(1, 5000)}"),
+            retweet_count=int(rnd.paretovariate(0.8) * 20),
+            entities={"hashtags": [{"text": t} for t in tags]},
+            text=text[:140],
+            **({"extended_tweet": SimpleNamespace(full_text=text)} if extended else {}))
+
+    def statuses(self, count):
+        """ function that yields synthetic statuses
+        :param count: number of statuses
+        :return: generator of status objects
+        """
+        rnd = self.rnd
+        for _ in range(count):
+            if rnd.random() < self.retweet_share:
+                original = rnd.choices(self.originals, self.original_weights)[0]
+                # every retweet increases retweet count of the original
+                original.retweet_count += 1
+                yield SimpleNamespace(retweeted_status=original, lang=original.lang)
+            else:
+                yield SimpleNamespace(lang="en", text=self._make_text([]))
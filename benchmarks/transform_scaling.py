@@ -0,0 +1,85 @@
+""" Python script that measures scaling of staging-transform row transformations with the number of worker processes.
+Synthetic landing data is transformed with 1, 2, 4 and 6 workers (or the counts provided), output of every run is
+compared with the single process output, timings are printed as json together with the CPU count of the host, speedup
+above the CPU count is not possible. Sentiment cache is cleared before every run, so runs do not reuse its results, eg.
+    python benchmarks/transform_scaling.py --rows 20000 --workers 1 2 4 6
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+import kinesis_event
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lambda')
+LANDING_COLS = ['record_id', 'timestamp', 'created', 'tweet_id', 'user_name', 'rt_count', 'hashtags', 'text']
+STAGING_COLS = ['hash_id', 'record_id', 'time_stamp', 'created', 'tweet_id', 'user_name', 'rt_count', 'hashtag',
+                'polarity', 'subjectivity', 'text', 'year', 'month', 'day']
+
+
+def load_handler(name):
+    """ function that loads Lambda handler module from its file, handler file names are not valid module names
+    :param name: handler name without .py extension
+    :return: module object
+    """
+    sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(LAMBDA_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_landing_frame(pd, rows, seed=0):
+    """ function that generates dataframe in the format of Landing zone csv files
+    :param pd: pandas module
+    :param rows: number of rows
+    :param seed: random generator seed
+    :return: Pandas dataframe
+    """
+    rnd = random.Random(seed)
+    records = []
+    for i in range(rows):
+        tweet = kinesis_event.make_tweet(rnd, i)
+        records.append([str(49590338271490256608559692538361571095921575989136588898 + i),
+                        "2020-09-01 10:%02d:%02d.000000+00:00" % (i // 60 % 60, i % 60),
+                        tweet["created"], tweet["tweet_id"], tweet["user_name"], tweet["rt_count"],
+                        tweet["hashtags"], tweet["text"]])
+    return pd.DataFrame(records, columns=LANDING_COLS)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="staging transform multi-process scaling benchmark")
+    arg_parser.add_argument('--rows', type=int, default=20000)
+    arg_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 6])
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    staging = load_handler('staging-transform')
+    frame = make_landing_frame(staging.pd, args.rows, args.seed)
+    # warm up lazy imports and TextBlob corpora before timing
+    staging.transform_frame(frame.head(10).copy(), STAGING_COLS, 1)
+
+    report = {"rows": args.rows, "cpu_count": os.cpu_count(), "arrow": staging.pyarrow is not None, "runs": []}
+    baseline = None
+    for workers in args.workers:
+        # forked workers inherit sentiment cache of this process, every run starts with an empty cache
+        staging.text_sentiment.cache_clear()
+        start = time.perf_counter()
+        df = staging.transform_frame(frame.copy(), STAGING_COLS, workers).reset_index(drop=True)
+        seconds = time.perf_counter() - start
+        if baseline is None:
+            baseline = (df, seconds)
+        report["runs"].append({"workers": workers, "seconds": round(seconds, 3),
+                               "rows_per_sec": round(args.rows / seconds, 1),
+                               "speedup": round(baseline[1] / seconds, 2),
+                               "output_rows": df.shape[0],
+                               "matches_first_run": bool(df.astype(str).equals(baseline[0].astype(str)))})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
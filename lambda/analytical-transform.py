@@ -6,28 +6,34 @@ Function also return indicators of data processing to be used by update-data-log
 :param ATHENA_OUT, output directory path, required parameter for Athena query execution
 :param TIME_ZONE, UTC timezone abbreviation to be used as home timezone, eg. 'Europe/Helsinki'
 """
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-import os
 from datetime import datetime
-from dateutil.parser import *
 import pytz
+import bootstrap
+import config_provider
+import instrumentation
+import profiling
 
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('analytical-transform')
+parser = bootstrap.lazy_import('dateutil.parser')
 
-target_db = os.environ['TARGET_DB']
-output = os.environ['ATHENA_OUT']
-source_tbl = os.environ['SOURCE_TABLE']
-target_tbl = os.environ['TARGET_TABLE']
-timezone = pytz.timezone('Europe/Helsinki')
 
-# Assigning Athena query variables
-query_1 = f"SELECT COUNT(time_stamp) AS count FROM {source_tbl}"
-query_2 = f"INSERT INTO {target_tbl} \
-    (SELECT * FROM {source_tbl})"
-rows_inserted = "0"
+@profiling.profiled
+@metrics.handler
+def lambda_handler(event, context):
+    target_db = config['TARGET_DB']
+    output = config['ATHENA_OUT']
+    source_tbl = config['SOURCE_TABLE']
+    target_tbl = config['TARGET_TABLE']
+    timezone = pytz.timezone(config.get('TIME_ZONE', 'Europe/Helsinki'))
 
+    # Assigning Athena query variables
+    query_1 = f"SELECT COUNT(time_stamp) AS count FROM {source_tbl}"
+    query_2 = f"INSERT INTO {target_tbl} \
+    (SELECT * FROM {source_tbl})"
+    rows_inserted = "0"
 
-def lambda_handler(event, context):
     def boto_safe_run(func):
         """ decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
         :param func: outer function to be passed to decorator
@@ -72,6 +78,8 @@ def lambda_handler(event, context):
             # get current query execution status
             response_2 = client.get_query_execution(QueryExecutionId=execution_id)
             status = response_2['QueryExecution']['Status']['State']
+        metrics.add("AthenaBytesScanned",
+                    response_2['QueryExecution'].get('Statistics', {}).get('DataScannedInBytes', 0), "Bytes")
 
         if status != 'SUCCEEDED':
             # handle query execution errors
@@ -98,18 +106,18 @@ def lambda_handler(event, context):
     # next three functions parse timestamp strings and return the required ts format, they are used to compile the output
     # record this Lambda function returns
     def get_year(x):
-        parsed_date = parse(x)
+        parsed_date = parser.parse(x)
         return parsed_date.year
     
     def get_month(x):
-        parsed_date = parse(x)
+        parsed_date = parser.parse(x)
         return parsed_date.month
     
     def get_day(x):
-        parsed_date = parse(x)
+        parsed_date = parser.parse(x)
         return parsed_date.day
         
-    client = boto3.client('athena')
+    client = bootstrap.client('athena')
     # get current count of rows in staging table
     result_1 = run_athena_query(client, query_1, target_db, output)
     result_2 = get_athena_result(client, result_1[2], 3)
@@ -123,6 +131,8 @@ def lambda_handler(event, context):
             rows_inserted = row_count
     
     print("rows_inserted: ", rows_inserted)
+    metrics.add("RecordsIn", int(row_count))
+    metrics.add("RecordsOut", int(rows_inserted))
 
     record_time = datetime.now(tz=timezone).strftime("%Y-%m-%d %H:%M:%S")
     out_record = f"'{record_time}', '{target_tbl}', {rows_inserted}, {get_year(record_time)}, {get_month(record_time)}, {get_day(record_time)}"
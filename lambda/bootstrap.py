@@ -0,0 +1,109 @@
+""" Python script with shared cold start helpers used by the Lambda functions of the project.
+AWS service clients and resources are created lazily on first use, kept at module scope and reused across warm invocations,
+so HTTP connections are pooled and kept alive between invocations. Heavy libraries (pandas, numpy, TextBlob, dateutil)
+are imported lazily on first attribute access. API calls of the clients are counted and timed by instrumentation module.
+It reads optional environmental variables
+:param MAX_POOL_CONNECTIONS, max number of connections kept in the pool of each client, default 10
+:param CONNECT_TIMEOUT, timeout in seconds to establish a connection, default 5
+:param READ_TIMEOUT, timeout in seconds to read from a connection, default 60
+:param MAX_ATTEMPTS, max number of attempts of boto3 standard retry mode, default 3
+"""
+import importlib
+import os
+import threading
+import boto3
+from botocore.config import Config
+import instrumentation
+
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+client_config = Config(
+    max_pool_connections=int(os.environ.get('MAX_POOL_CONNECTIONS', '10')),
+    connect_timeout=int(os.environ.get('CONNECT_TIMEOUT', '5')),
+    read_timeout=int(os.environ.get('READ_TIMEOUT', '60')),
+    tcp_keepalive=True,
+    retries={'max_attempts': int(os.environ.get('MAX_ATTEMPTS', '3')), 'mode': 'standard'}
+)
+
+
+def client(service_name, region_name=None, max_attempts=None):
+    """ function that returns module scope service client, the client is created on the first call. It takes input
+    :param service_name: name of AWS service, eg. 's3'
+    :param region_name: the name of AWS region, default region of the Lambda function is used if not provided
+    :param max_attempts: max number of attempts including the first one, 1 disables boto3 retries of a caller that
+    retries itself. Retry configuration of client_config is used if not provided
+    :return: boto3 service client
+    """
+    key = (service_name, region_name, max_attempts)
+    if key not in _clients:
+        # boto3 session creation is not thread safe, lock prevents concurrent initialisation from worker threads
+        with _lock:
+            if key not in _clients:
+                config = client_config
+                if max_attempts is not None:
+                    # total_max_attempts includes the first attempt, unlike max_attempts of botocore
+                    config = client_config.merge(Config(retries={'total_max_attempts': max_attempts,
+                                                                 'mode': 'standard'}))
+                _clients[key] = instrumentation.track_client(
+                    boto3.client(service_name, region_name=region_name, config=config))
+    return _clients[key]
+
+
+def resource(service_name, region_name=None):
+    """ function that returns module scope service resource, the resource is created on the first call. It takes input
+    :param service_name: name of AWS service, eg. 's3'
+    :param region_name: the name of AWS region, default region of the Lambda function is used if not provided
+    :return: boto3 service resource
+    """
+    key = (service_name, region_name)
+    if key not in _resources:
+        with _lock:
+            if key not in _resources:
+                _resources[key] = boto3.resource(service_name, region_name=region_name, config=client_config)
+                instrumentation.track_client(_resources[key].meta.client)
+    return _resources[key]
+
+
+def reset():
+    """ function that drops cached clients and resources, it is used in worker processes forked from a process
+    that has already created them, since connection pools can not be shared between processes
+    :return: None
+    """
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+
+
+class LazyModule:
+    """
+    Class LazyModule is a placeholder for a module that is imported on the first attribute access. It is used to keep
+    heavy libraries out of module load time of Lambda functions.
+    """
+    def __init__(self, name):
+        """ Class constructor, defines class parameters
+        :param name: full name of the module, eg. 'dateutil.parser'
+        """
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """ function that returns a module placeholder which imports the module on the first attribute access
+    :param name: full name of the module
+    :return: LazyModule object
+    """
+    return LazyModule(name)
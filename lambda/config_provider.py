@@ -0,0 +1,128 @@
+""" Python script that creates ConfigProvider class used by the Lambda functions of the project to read their configuration.
+Configuration data is stored in the same DynamoDB table that update-lambda-from-ddb Lambda uses, one item per Lambda function
+with environmental variable data under 'Variables' key. Item data is loaded at cold start, cached in memory for a defined
+time period and refreshed in the background during warm invocations, so configuration changes take effect without
+redeploying Lambda functions. Lambda environmental variables are used as a fallback. It reads environmental variables
+:param CONFIG_TABLE, the name of DynamoDB table with configuration data (falls back to DDB_TABLE)
+:param CONFIG_KEY, the name of defined primary key in DynamoDB table (falls back to DDB_KEY, default 'Lambda')
+:param CONFIG_ITEM, the name of the item to load (falls back to AWS_LAMBDA_FUNCTION_NAME set by Lambda runtime)
+:param CONFIG_TTL_SECONDS, time in seconds cached configuration data is considered fresh, default 300
+:param MY_AWS_REGION, AWS region where DynamoDB table has been created (falls back to AWS_REGION)
+"""
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError, ParamValidationError
+import bootstrap
+
+
+class ConfigProvider:
+    """
+    Class ConfigProvider provides read access to the configuration values of a Lambda function. Values stored in DynamoDB
+    take precedence over Lambda environmental variables, which are used when DynamoDB item or value is not available.
+    """
+    def __init__(self, item_name=None, table_name=None, key_name=None, ttl_seconds=None, region=None, ddb_client=None):
+        """ Class constructor, defines class parameters. Parameters that are not provided are read from environmental variables
+        :param item_name: name of the DynamoDB item (Lambda function name) to load configuration for
+        :param table_name: the name of DynamoDB table
+        :param key_name: the name of primary key in DynamoDB table
+        :param ttl_seconds: time in seconds cached configuration data is considered fresh
+        :param region: the name of AWS region where DynamoDB table is located
+        :param ddb_client: DynamoDB service client
+        """
+        self.item_name = item_name or os.environ.get('CONFIG_ITEM') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+        self.table_name = table_name or os.environ.get('CONFIG_TABLE') or os.environ.get('DDB_TABLE')
+        self.key_name = key_name or os.environ.get('CONFIG_KEY') or os.environ.get('DDB_KEY', 'Lambda')
+        self.ttl = ttl_seconds if ttl_seconds is not None else int(os.environ.get('CONFIG_TTL_SECONDS', '300'))
+        self.region = region or os.environ.get('MY_AWS_REGION') or os.environ.get('AWS_REGION')
+        self._client = ddb_client
+        self._values = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    @property
+    def enabled(self):
+        """ DynamoDB lookup is only used when both table and item names are known, otherwise only environmental
+        variables are read
+        """
+        return bool(self.table_name and self.item_name)
+
+    def _get_client(self):
+        # DynamoDB client is created on the first lookup so that importing this module does not add to cold start
+        if self._client is None:
+            self._client = bootstrap.client('dynamodb', self.region)
+        return self._client
+
+    def _load(self):
+        """ function that loads item data from DynamoDB. Environmental variable data is located under 'Variables' key,
+        stored in the same format update-lambda-from-ddb Lambda reads
+        :return: dictionary with configuration data, None when the item could not be loaded
+        """
+        try:
+            response = self._get_client().get_item(TableName=self.table_name,
+                                                   Key={self.key_name: {'S': self.item_name}})
+            item = response.get('Item')
+            if not item or 'Variables' not in item:
+                print(f"No configuration item {self.item_name} found in {self.table_name}")
+                return None
+            variables = item['Variables'].get('S', '{}').replace("'", "\"")
+            return {k: str(v) for k, v in json.loads(variables).items()}
+        # configuration errors must not break the handler, environmental variables are used instead
+        except ClientError as e:
+            print("DynamoDB client returned error: ", e.response['Error']['Message'])
+        except (ParamValidationError, ValueError) as e:
+            print(f"Configuration item {self.item_name} could not be loaded: {e}")
+        return None
+
+    def refresh(self):
+        """ function that reloads configuration data from DynamoDB and stores it in cache. Previously cached data
+        is kept when the reload fails
+        :return: None
+        """
+        values = self._load()
+        with self._lock:
+            if values is not None:
+                self._values = values
+            elif self._values is None:
+                self._values = {}
+            self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        # only one refresh runs at a time, stale values are served while it is running
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def _current(self):
+        """ function that returns cached configuration data. Data is loaded synchronously at cold start and
+        refreshed in the background once the TTL has expired
+        :return: dictionary with configuration data
+        """
+        if not self.enabled:
+            return {}
+        if self._values is None:
+            self.refresh()
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_in_background()
+        return self._values
+
+    def get(self, name, default=None):
+        """ function that returns configuration value by name. It takes input
+        :param name: name of the configuration variable
+        :param default: value to return when the variable is found neither in DynamoDB nor in environmental variables
+        :return: string with configuration value
+        """
+        values = self._current()
+        if name in values:
+            return values[name]
+        return os.environ.get(name, default)
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
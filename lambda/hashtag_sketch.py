@@ -0,0 +1,224 @@
+""" Python script with streaming summaries used by staging-transform Lambda to compute hashtag rollups at ingest time.
+CountMinSketch estimates the count of any hashtag, SpaceSaving keeps the top-K most frequent hashtags together with
+running polarity and subjectivity sums, HashtagRollup combines both for a single time bucket. All summaries use bounded
+memory that does not depend on the number of records, and snapshots of the same size are mergeable, so rollups of
+several runs (or several staging workers) can be combined without reprocessing the data.
+Error bounds, with N being the total count of the bucket:
+    CountMinSketch - estimate is never below true count and exceeds it by more than eps * N with probability at most delta
+    SpaceSaving - every hashtag with true count above N / k is tracked, tracked count exceeds true count by at most
+    its 'error' value, which is not greater than N / k
+"""
+import hashlib
+import math
+import struct
+
+
+class CountMinSketch:
+    """
+    Class CountMinSketch is a depth x width table of counters. Every item increments one counter in each row,
+    estimate is the minimum of its counters.
+    """
+    def __init__(self, eps=0.001, delta=0.01, width=None, depth=None):
+        """ Class constructor, defines class parameters. Table size is computed from error bounds if it is not provided
+        :param eps: relative error bound of the estimate
+        :param delta: probability of exceeding the error bound
+        :param width: number of counters in a row
+        :param depth: number of rows
+        """
+        self.width = width or int(math.ceil(math.e / eps))
+        self.depth = depth or int(math.ceil(math.log(1 / delta)))
+        self.total = 0
+        self.table = [[0] * self.width for _ in range(self.depth)]
+
+    def _positions(self, item):
+        # deterministic hashing, built-in hash() is salted per process and would make snapshots non-mergeable
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        for row, pos in enumerate(self._positions(item)):
+            self.table[row][pos] += count
+        self.total += count
+
+    def estimate(self, item):
+        return min(self.table[row][pos] for row, pos in enumerate(self._positions(item)))
+
+    def merge(self, other):
+        """ function that adds counters of other sketch of the same size to this sketch
+        :param other: CountMinSketch object
+        :return: this sketch
+        """
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Only sketches of the same size can be merged")
+        for row in range(self.depth):
+            self.table[row] = [a + b for a, b in zip(self.table[row], other.table[row])]
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        return {"width": self.width, "depth": self.depth, "total": self.total, "table": self.table}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(width=data["width"], depth=data["depth"])
+        sketch.total = data["total"]
+        sketch.table = [list(row) for row in data["table"]]
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Class SpaceSaving keeps at most k counters. When a new item arrives and all counters are taken, the item with
+    the smallest count is replaced and the new item inherits its count as overestimation error. Polarity and
+    subjectivity sums and the number of observations are accumulated from the moment the item is tracked.
+    """
+    def __init__(self, k=100):
+        """ Class constructor, defines class parameters
+        :param k: max number of tracked items
+        """
+        self.k = k
+        self.total = 0
+        # item -> [count, error, observed, polarity_sum, subjectivity_sum]
+        self.counters = {}
+
+    def add(self, item, polarity=0.0, subjectivity=0.0, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is None:
+            if len(self.counters) < self.k:
+                counter = self.counters[item] = [0, 0, 0, 0.0, 0.0]
+            else:
+                victim = min(self.counters, key=lambda x: (self.counters[x][0], x))
+                min_count = self.counters.pop(victim)[0]
+                counter = self.counters[item] = [min_count, min_count, 0, 0.0, 0.0]
+        counter[0] += count
+        counter[2] += count
+        counter[3] += polarity * count
+        counter[4] += subjectivity * count
+
+    def min_count(self):
+        # count an untracked item can have at most
+        if len(self.counters) < self.k:
+            return 0
+        return min(c[0] for c in self.counters.values())
+
+    def merge(self, other):
+        """ function that merges other summary into this one. Items missing from one of the summaries get its
+        min count added to both count and error, then the k largest counters are kept
+        :param other: SpaceSaving object
+        :return: this summary
+        """
+        min_self, min_other = self.min_count(), other.min_count()
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            a = self.counters.get(item, [min_self, min_self, 0, 0.0, 0.0])
+            b = other.counters.get(item, [min_other, min_other, 0, 0.0, 0.0])
+            merged[item] = [x + y for x, y in zip(a, b)]
+        self.k = max(self.k, other.k)
+        self.counters = dict(sorted(merged.items(), key=lambda x: (-x[1][0], x[0]))[:self.k])
+        self.total += other.total
+        return self
+
+    def top(self, n=None):
+        """ function that returns tracked items ordered by count
+        :param n: number of items to return, all tracked items if not provided
+        :return: list of dictionaries with hashtag, count, error and sentiment indicators
+        """
+        items = sorted(self.counters.items(), key=lambda x: (-x[1][0], x[0]))[:n]
+        return [{"hashtag": item, "count": c[0], "error": c[1], "observed": c[2],
+                 "polarity_sum": c[3], "subjectivity_sum": c[4]} for item, c in items]
+
+    def to_dict(self):
+        return {"k": self.k, "total": self.total, "counters": self.counters}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(k=data["k"])
+        summary.total = data["total"]
+        summary.counters = {item: list(c) for item, c in data["counters"].items()}
+        return summary
+
+
+class HashtagRollup:
+    """
+    Class HashtagRollup holds hashtag summaries of a single time bucket together with running polarity and
+    subjectivity sums of all hashtag occurrences in the bucket.
+    """
+    def __init__(self, bucket, k=100, eps=0.001, delta=0.01):
+        """ Class constructor, defines class parameters
+        :param bucket: start of the time bucket, string in '%Y-%m-%d %H:%M:%S' format
+        :param k: number of top hashtags to keep
+        :param eps: relative error bound of Count-Min estimates
+        :param delta: probability of exceeding Count-Min error bound
+        """
+        self.bucket = bucket
+        self.top_k = SpaceSaving(k)
+        self.cms = CountMinSketch(eps, delta)
+        self.polarity_sum = 0.0
+        self.subjectivity_sum = 0.0
+
+    def add(self, hashtag, polarity, subjectivity):
+        self.top_k.add(hashtag, polarity, subjectivity)
+        self.cms.add(hashtag)
+        self.polarity_sum += polarity
+        self.subjectivity_sum += subjectivity
+
+    def merge(self, other):
+        if self.bucket != other.bucket:
+            raise ValueError("Only rollups of the same time bucket can be merged")
+        self.top_k.merge(other.top_k)
+        self.cms.merge(other.cms)
+        self.polarity_sum += other.polarity_sum
+        self.subjectivity_sum += other.subjectivity_sum
+        return self
+
+    def rows(self):
+        """ function that returns top hashtags of the bucket as table rows
+        :return: list of [bucket, hashtag, count, error, cms_estimate, polarity_sum, subjectivity_sum, observed] lists
+        """
+        return [[self.bucket, t["hashtag"], t["count"], t["error"], self.cms.estimate(t["hashtag"]),
+                 round(t["polarity_sum"], 6), round(t["subjectivity_sum"], 6), t["observed"]]
+                for t in self.top_k.top()]
+
+    def to_dict(self):
+        return {"bucket": self.bucket, "top_k": self.top_k.to_dict(), "cms": self.cms.to_dict(),
+                "polarity_sum": self.polarity_sum, "subjectivity_sum": self.subjectivity_sum}
+
+    @classmethod
+    def from_dict(cls, data):
+        rollup = cls(data["bucket"])
+        rollup.top_k = SpaceSaving.from_dict(data["top_k"])
+        rollup.cms = CountMinSketch.from_dict(data["cms"])
+        rollup.polarity_sum = data["polarity_sum"]
+        rollup.subjectivity_sum = data["subjectivity_sum"]
+        return rollup
+
+
+def bucket_start(time_stamp, bucket_minutes=60):
+    """ function that returns start of the time bucket for timestamp string in '%Y-%m-%d %H:%M:%S' format
+    :param time_stamp: timestamp string
+    :param bucket_minutes: bucket size in minutes, a divisor of 60 or a multiple of 60 up to a day
+    :return: timestamp string of the bucket start
+    """
+    hour, minute = int(time_stamp[11:13]), int(time_stamp[14:16])
+    minutes = (hour * 60 + minute) // bucket_minutes * bucket_minutes
+    return f"{time_stamp[:10]} {minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def build_rollups(records, bucket_minutes=60, k=100, eps=0.001, delta=0.01):
+    """ function that builds rollups from hashtag records. It takes input
+    :param records: iterable of (time_stamp, hashtag, polarity, subjectivity) tuples
+    :param bucket_minutes: bucket size in minutes
+    :param k: number of top hashtags to keep per bucket
+    :param eps: relative error bound of Count-Min estimates
+    :param delta: probability of exceeding Count-Min error bound
+    :return: dictionary of bucket start and HashtagRollup object
+    """
+    rollups = {}
+    for time_stamp, hashtag, polarity, subjectivity in records:
+        bucket = bucket_start(time_stamp, bucket_minutes)
+        if bucket not in rollups:
+            rollups[bucket] = HashtagRollup(bucket, k, eps, delta)
+        rollups[bucket].add(hashtag, float(polarity), float(subjectivity))
+    return rollups
@@ -0,0 +1,241 @@
+""" Python script with shared instrumentation of the Lambda functions of the project. Metrics of an invocation are
+collected in Metrics object and printed when the invocation ends in CloudWatch Embedded Metric Format (EMF), so they are
+extracted from Lambda logs as CloudWatch metrics with Stage dimension. Calls of AWS clients created by bootstrap module
+are counted and timed per service with botocore event hooks, eg. S3Calls and S3Latency, hot sections are timed with
+timer() context manager or timed() decorator. In no-op mode nothing is collected or printed, timers do not read the
+clock. It reads optional environmental variables
+:param METRICS_NAMESPACE, CloudWatch namespace of the metrics, default 'TwitterETL'
+:param METRICS_MODE, 'emf' prints metric records, 'off' is no-op mode, default 'emf' in Lambda and 'off' in local runs
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# max number of values of a single metric in EMF record, values over the limit are printed in additional records
+MAX_VALUES = 100
+_null_timer = contextlib.nullcontext()
+
+
+def metrics_enabled():
+    # metrics are printed by default only in Lambda environment
+    default = 'emf' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else 'off'
+    return os.environ.get('METRICS_MODE', default).lower() != 'off'
+
+
+def emf_record(namespace, dimensions, metrics, properties=None):
+    """ function that builds CloudWatch Embedded Metric Format record. It takes input
+    :param namespace: CloudWatch namespace
+    :param dimensions: dictionary of dimension name and value
+    :param metrics: dictionary of metric name and (value, unit) tuple, value can be a list of values
+    :param properties: optional dictionary of values logged with the metrics, they are not metrics or dimensions
+    :return: dictionary of EMF record
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()]
+            }]
+        }
+    }
+    record.update(properties or {})
+    record.update(dimensions)
+    record.update({name: value for name, (value, _) in metrics.items()})
+    return record
+
+
+class Metrics:
+    """
+    Class Metrics collects metrics of a pipeline stage during an invocation. Counters (records, bytes, calls) are summed,
+    gauges (rates) keep the last value and observations (latencies, step times) keep every value.
+    """
+    def __init__(self, stage, namespace=None, enabled=None):
+        """ Class constructor, defines class parameters
+        :param stage: name of the pipeline stage, used as Stage dimension
+        :param namespace: CloudWatch namespace, METRICS_NAMESPACE or 'TwitterETL' if not provided
+        :param enabled: True to print metrics, False for no-op mode, METRICS_MODE is used if not provided
+        """
+        self.stage = stage
+        self.namespace = namespace or os.environ.get('METRICS_NAMESPACE', 'TwitterETL')
+        self.enabled = metrics_enabled() if enabled is None else enabled
+        self.properties = {}
+        self._counters = {}
+        self._gauges = {}
+        self._values = {}
+        # AWS calls are recorded from worker threads of the Lambda functions
+        self._lock = threading.Lock()
+
+    def add(self, name, value, unit='Count'):
+        """ function that adds value to a counter metric
+        :param name: metric name, eg. 'RecordsIn'
+        :param value: number to add
+        :param unit: CloudWatch unit
+        :return: None
+        """
+        if self.enabled:
+            with self._lock:
+                total = self._counters.get(name, (0, unit))[0]
+                self._counters[name] = (total + value, unit)
+
+    def put(self, name, value, unit='None'):
+        """ function that sets value of a gauge metric, eg. cache hit rate
+        :param name: metric name
+        :param value: metric value
+        :param unit: CloudWatch unit
+        :return: None
+        """
+        if self.enabled:
+            with self._lock:
+                self._gauges[name] = (value, unit)
+
+    def observe(self, name, value, unit='Milliseconds'):
+        """ function that records a single observation, eg. call latency. When the metric has MAX_VALUES observations
+        they are printed right away, so long running invocations do not keep them in memory
+        :param name: metric name
+        :param value: observed value
+        :param unit: CloudWatch unit
+        :return: None
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            values = self._values.setdefault(name, ([], unit))[0]
+            values.append(value)
+            if len(values) < MAX_VALUES:
+                return
+            del self._values[name]
+        self._print(emf_record(self.namespace, {"Stage": self.stage}, {name: (values, unit)}, self.properties))
+
+    def timer(self, name):
+        """ function that returns context manager which records wall time of its block in milliseconds
+        :param name: metric name, eg. 'LoadTime'
+        :return: context manager
+        """
+        if not self.enabled:
+            return _null_timer
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name):
+        """ decorator that records wall time of every call of the decorated function
+        :param name: metric name
+        :return: decorator
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def inner_function(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self._timer(name):
+                    return func(*args, **kwargs)
+            return inner_function
+        return decorator
+
+    def handler(self, func):
+        """ decorator of Lambda handler. It makes the object active metrics of AWS call hooks and module level helpers,
+        records handler wall time and prints collected metrics when the invocation ends, also when it fails
+        :param func: Lambda handler function
+        :return: decorated handler
+        """
+        @functools.wraps(func)
+        def inner_function(event, context):
+            global _active
+            _active = self
+            if self.enabled and getattr(context, 'aws_request_id', None):
+                self.properties["RequestId"] = context.aws_request_id
+            try:
+                with self.timer('HandlerTime'):
+                    return func(event, context)
+            finally:
+                self.flush()
+        return inner_function
+
+    def emit(self, metrics, dimensions=None):
+        """ function that prints a separate EMF record, it is used for metrics with their own dimensions
+        :param metrics: dictionary of metric name and (value, unit) tuple
+        :param dimensions: dictionary of dimension name and value, Stage dimension if not provided
+        :return: printed record, None in no-op mode
+        """
+        if not self.enabled:
+            return None
+        return self._print(emf_record(self.namespace, dimensions or {"Stage": self.stage}, metrics, self.properties))
+
+    def flush(self):
+        """ function that prints collected metrics as EMF record and clears them
+        :return: printed record, None if there are no metrics or in no-op mode
+        """
+        with self._lock:
+            metrics = {**self._counters, **self._gauges, **self._values}
+            self._counters, self._gauges, self._values = {}, {}, {}
+        record = None
+        if self.enabled and metrics:
+            record = self._print(emf_record(self.namespace, {"Stage": self.stage}, metrics, self.properties))
+        self.properties = {}
+        return record
+
+    @staticmethod
+    def _print(record):
+        print(json.dumps(record, default=str))
+        return record
+
+
+# metrics of the running invocation, set by Metrics.handler, no-op until a handler runs
+_active = Metrics('local', enabled=False)
+
+
+def active():
+    # metrics of the running invocation
+    return _active
+
+
+def timer(name):
+    """ function that returns context manager recording wall time of its block in active metrics, it is used in
+    modules shared by several Lambda functions
+    :param name: metric name
+    :return: context manager
+    """
+    return _active.timer(name)
+
+
+def add(name, value, unit='Count'):
+    # adds value to a counter of active metrics
+    _active.add(name, value, unit)
+
+
+def _before_call(context=None, **kwargs):
+    if context is not None:
+        context['metrics_start'] = time.perf_counter()
+
+
+def _after_call(model=None, context=None, **kwargs):
+    start = (context or {}).get('metrics_start')
+    if start is None or not _active.enabled:
+        return
+    service = str(model.service_model.service_id).replace(' ', '')
+    _active.add(f"{service}Calls", 1)
+    _active.observe(f"{service}Latency", (time.perf_counter() - start) * 1000)
+
+
+def track_client(client):
+    """ function that registers botocore event hooks counting and timing API calls of the client in active metrics.
+    Hooks are not registered in no-op mode
+    :param client: boto3 service client
+    :return: the same client
+    """
+    if metrics_enabled():
+        # registered first, so the call is timed also when another handler returns the response, eg. botocore Stubber
+        client.meta.events.register_first('before-call.*.*', _before_call)
+        client.meta.events.register('after-call.*.*', _after_call)
+    return client
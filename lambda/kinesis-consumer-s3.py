@@ -1,85 +1,262 @@
 """ Lambda function that subscribes to Kinesis Data stream topic and saves its records in csv format S3.
-It requires environmental variables
+It has two entry points:
+    lambda_handler - polls the stream itself for RUN_SECONDS, it runs next to Kinesis producer in Step Functions Parallel state
+    event_source_handler - receives record batches from Kinesis event source mapping, so ingest scales with shard count
+    and parallelization factor. When the batch can not be saved its records are reported in 'batchItemFailures'
+    (requires ReportBatchItemFailures function response type) to be retried. Malformed records are logged and skipped,
+    retrying them can not succeed and would block the shard. It keeps hashtag counts of tumbling window in aggregation state.
+Both entry points save records to S3 using the same batch path. It requires environmental variables
 :param MY_AWS_REGION, AWS region where Kinesis stream has been created.
 :param STREAM_NAME, the name of Kinesis data stream
 :param BUCKET_NAME, name of the target S3 bucket
 :param FILE_NAME, base string to use in the exported file name
 :param TIME_ZONE, UTC timezone abbreviation to be used as home timezone, eg. 'Europe/Helsinki'
 :param RUN_SECONDS, activity time in seconds for Kinesis producer'
+:param TWEET_COLS, comma separated names of record id, timestamp and record data columns
+:param WINDOW_TOP_HASHTAGS, optional, number of hashtags kept in tumbling window state, default 100
 """
+import base64
 import json
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
 from io import StringIO
-import pandas as pd
-import os
 from datetime import datetime, timedelta
 import pytz
+import time
+import bootstrap
+import config_provider
+import instrumentation
+import profiling
 
-aws_region = os.environ['MY_AWS_REGION']
-stream_name = os.environ['STREAM_NAME']
-bucket_name = os.environ['BUCKET_NAME']
-file_name = os.environ['FILE_NAME']
-time_zone = os.environ['TIME_ZONE']
-run_seconds = int(os.environ['RUN_SECONDS'])
-tweet_cols = os.environ['TWEET_COLS']
-cols = tweet_cols.split(',')
-id_col = cols[0]
-old_col = cols[-1]
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('kinesis-consumer-s3')
+pd = bootstrap.lazy_import('pandas')
 
 
-def lambda_handler(event, context):
+def boto_safe_run(func):
+    """
+    decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
+    :param func: outer function to be passed to decorator
+    :return: executed inner function
+    """
+    def inner_function(*args, **kwargs):
+        # inner function that uses arguments of the outer function runs it applying error handling functionality
+        try:
+            return func(*args, **kwargs)
+        except ClientError as e:
+            print("AWS client returned error: ", e.response['Error']['Message'])
+            raise e
+        except ParamValidationError as e:
+            raise ValueError(f'The parameters you provided are incorrect: {e}')
+    return inner_function
+
+
+def tweet_to_df(data_frame, id_col):
+    # transform tweet_data field from string to json object, then extract values to list
+    _df_1 = data_frame.tweet_data.apply(json.loads).values.tolist()
+    # create dataframe from extracted values
+    _df_2 = pd.DataFrame.from_records(_df_1)
+    # add id column from initial dataframe to be used in a subsequent join
+    _df_2.insert(0, id_col, pd.Series(data_frame[id_col]))
+    return _df_2
+
+
+def merge_df(df1, df2, index_col, drop_col):
+    df1 = df1.set_index(index_col)
+    df2 = df2.set_index(index_col)
+    df3 = pd.merge(df1, df2, how='inner', left_index=True, right_index=True)
+    df = df3.drop(drop_col, axis=1)
+    return df
+
+
+@boto_safe_run
+def save_df_to_s3(df, s3_resource, bucket, filename):
+    """ function that saves contents of a dataframe to S3
+    :param df: source dataframe
+    :param s3_resource: S3 resource client
+    :param bucket: target bucket name
+    :param filename: target file key (name)
+    :return: None
+    """
+    csv_buffer = StringIO() # memory buffer to store dataframe data
+    df.to_csv(csv_buffer, header=False)
+    body = csv_buffer.getvalue()
+    s3_resource.Object(bucket, filename).put(Body=body)
+    metrics.add("BytesWritten", len(body), "Bytes")
+
+
+def get_file_name(tz, filename):
+    timezone = pytz.timezone(tz)
+    record_time = datetime.now(tz=timezone).strftime("%Y-%m-%d_%H%M%S")
+    _file_name = \
+        "landing/" + \
+        record_time.split("_")[0].split("-")[0] + "/" + \
+        record_time.split("_")[0].split("-")[1] + "/" + \
+        record_time.split("_")[0].split("-")[2] + "/" + \
+        filename + "-" + record_time.split("_")[1] + ".csv"
+    return _file_name
+
+
+def save_records(tweet_records, s3_resource, bucket, filename, tz, cols):
+    """ function that converts a batch of Kinesis records into dataframe and saves it in csv format to S3 Landing zone.
+    It is used by both entry points of this Lambda. It takes input
+    :param tweet_records: iterable of [record_id, timestamp, data] lists
+    :param s3_resource: S3 resource client
+    :param bucket: target bucket name
+    :param filename: base string to use in the exported file name
+    :param tz: UTC timezone abbreviation of home timezone
+    :param cols: list of record id, timestamp and record data column names
+    :return: number of records saved
+    """
+    id_col = cols[0]
+    old_col = cols[-1]
+    df_1 = pd.DataFrame(tweet_records, columns=cols)
+    metrics.add("RecordsIn", df_1.shape[0])
+    if df_1.shape[0] > 0:
+        with metrics.timer("ConvertTime"):
+            df_2 = tweet_to_df(df_1, id_col)
+            df_3 = merge_df(df_1, df_2, id_col, old_col)
+        full_name = get_file_name(tz, filename)
+        with metrics.timer("SaveTime"):
+            save_df_to_s3(df_3, s3_resource, bucket, full_name)
+        count_row = df_3.shape[0]
+        metrics.add("RecordsOut", count_row)
+        print(f"{count_row} records saved to CSV file on S3")
+        return count_row
+    print("No new records received from Kinesis data stream")
+    return 0
+
+
+def decode_event_record(record):
+    """ function that decodes a record of Kinesis event source mapping batch into the format returned by get_records
+    :param record: Kinesis event record
+    :return: [record_id, timestamp, data] list, data is validated to be a json object
+    """
+    kinesis = record['kinesis']
+    data = base64.b64decode(kinesis['data']).decode("utf-8")
+    if not isinstance(json.loads(data), dict):
+        raise ValueError("record data is not a json object")
+    timestamp = datetime.fromtimestamp(kinesis['approximateArrivalTimestamp'], tz=pytz.utc)
+    return [kinesis['sequenceNumber'], timestamp, data]
+
+
+def update_window_state(state, tweet_records, top_n):
+    """ function that adds batch indicators to tumbling window aggregation state. Only top_n hashtags by count are kept
+    so that the state stays within event source mapping state size limit. It takes input
+    :param state: aggregation state of the window received with the event
+    :param tweet_records: list of decoded [record_id, timestamp, data] lists
+    :param top_n: number of hashtags to keep in the state
+    :return: updated aggregation state
+    """
+    state = dict(state or {})
+    hashtags = dict(state.get("hashtags", {}))
+    for record in tweet_records:
+        for tag in json.loads(record[2]).get("hashtags", "").split():
+            hashtags[tag] = hashtags.get(tag, 0) + 1
+    state["records"] = state.get("records", 0) + len(tweet_records)
+    state["hashtags"] = dict(sorted(hashtags.items(), key=lambda x: (-x[1], x[0]))[:top_n])
+    return state
 
-    def boto_safe_run(func):
-        """
-        decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
-        :param func: outer function to be passed to decorator
-        :return: executed inner function
-        """
-        def inner_function(*args, **kwargs):
-            # inner function that uses arguments of the outer function runs it applying error handling functionality
-            try:
-                return func(*args, *kwargs)
-            except ClientError as e:
-                print("AWS client returned error: ", e.response['Error']['Message'])
-                raise e
-            except ParamValidationError as e:
-                raise ValueError(f'The parameters you provided are incorrect: {e}')
-        return inner_function
+
+@profiling.profiled
+@metrics.handler
+def event_source_handler(event, context):
+    bucket_name = config['BUCKET_NAME']
+    file_name = config['FILE_NAME']
+    time_zone = config['TIME_ZONE']
+    cols = config['TWEET_COLS'].split(',')
+    top_n = int(config.get('WINDOW_TOP_HASHTAGS', '100'))
+
+    tweet_records = []
+    failures = []
+    shard_id = None
+    # decode records, records that can not be decoded are logged and skipped, only transient failures are retried
+    for record in event.get('Records', []):
+        try:
+            tweet_records.append(decode_event_record(record))
+        except (KeyError, ValueError, TypeError) as e:
+            sequence_number = record.get('kinesis', {}).get('sequenceNumber')
+            print(f"Record {sequence_number} could not be decoded and is skipped: {e}")
+            metrics.add("MalformedRecords", 1)
+            continue
+        if shard_id is None:
+            # event id is '<shard id>:<sequence number>'
+            shard_id = record.get('eventID', '').split(':')[0] or event.get('shardId', 'shard')
+
+    if tweet_records:
+        # sequence numbers are unique only within a shard, shard id and full first sequence number keep file names
+        # of concurrent batches of all shards unique
+        batch_file_name = file_name + "-" + shard_id + "-" + tweet_records[0][0]
+        try:
+            save_records(tweet_records, bootstrap.resource('s3'), bucket_name, batch_file_name, time_zone, cols)
+        except (ClientError, ValueError) as e:
+            # batch was not saved, all its records are retried
+            print(f"Batch could not be saved: {e}")
+            failures = [{"itemIdentifier": r[0]} for r in tweet_records]
+
+    metrics.add("FailedRecords", len(failures))
+    response = {"batchItemFailures": failures}
+    if 'window' in event:
+        # tumbling window mode, aggregation state is carried between invocations of the same window
+        failed_ids = {f["itemIdentifier"] for f in failures}
+        saved = [r for r in tweet_records if r[0] not in failed_ids]
+        state = update_window_state(event.get('state'), saved, top_n)
+        if event.get('isFinalInvokeForWindow'):
+            print(json.dumps({"shard_id": event.get('shardId'), "window": event['window'], "state": state}))
+        response["state"] = state
+    return response
+
+
+@profiling.profiled
+@metrics.handler
+def lambda_handler(event, context):
+    aws_region = config['MY_AWS_REGION']
+    stream_name = config['STREAM_NAME']
+    bucket_name = config['BUCKET_NAME']
+    file_name = config['FILE_NAME']
+    time_zone = config['TIME_ZONE']
+    run_seconds = int(config['RUN_SECONDS'])
+    tweet_cols = config['TWEET_COLS']
+    cols = tweet_cols.split(',')
 
     @ boto_safe_run
-    def get_kinesis_shard_iterator(client, stream_name):
-        """ function that subscribes Kinesis consumer to data stream and keeps it active for a defined time period.
+    def get_kinesis_shard_iterators(client, stream_name, known_shards, iterator_type):
+        """ function that subscribes Kinesis consumer to all shards of data stream that it is not subscribed to yet.
         It takes parameters
         :param stream_name: the name of the stream
-        while running it generates list of kinesis records - one record per shard iterator.
+        :param known_shards: set of shard ids the consumer is already subscribed to, it is updated with new shard ids
+        :param iterator_type: shard iterator type, 'LATEST' at start, 'TRIM_HORIZON' for child shards created by resharding
+        :return: dictionary of shard id and shard iterator
         """
-        # get Kinesis stream params - shard id and shard iterator
-        response = client.describe_stream(StreamName=stream_name)
-        my_shard_id = response['StreamDescription']['Shards'][0]['ShardId']
-        shard_iterator = client.get_shard_iterator(StreamName=stream_name,
-                                                           ShardId=my_shard_id,
-                                                           ShardIteratorType='LATEST')
-        my_shard_iterator = shard_iterator['ShardIterator']
-        return my_shard_iterator
+        iterators = {}
+        paginator = client.get_paginator('list_shards')
+        for page in paginator.paginate(StreamName=stream_name):
+            for shard in page['Shards']:
+                shard_id = shard['ShardId']
+                # closed shards have ending sequence number
+                if shard_id in known_shards or 'EndingSequenceNumber' in shard['SequenceNumberRange']:
+                    continue
+                shard_iterator = client.get_shard_iterator(StreamName=stream_name,
+                                                           ShardId=shard_id,
+                                                           ShardIteratorType=iterator_type)
+                iterators[shard_id] = shard_iterator['ShardIterator']
+                known_shards.add(shard_id)
+        return iterators
 
     @ boto_safe_run
-    def subscribe_to_stream(client, iterator, seconds_running):
+    def subscribe_to_stream(client, stream_name, seconds_running):
         """ function that subscribes Kinesis consumer to data stream and keeps it active for a defined time period.
+        Shards are read in turns, when a shard is closed by resharding consumer subscribes to its child shards.
         It takes parameters
         :param stream_name: the name of the stream
         :param seconds_running: activity time in seconds for Kinesis consumer
         while running it generates list of kinesis records - one record per shard iterator.
         """
+        known_shards = set()
+        iterators = get_kinesis_shard_iterators(client, stream_name, known_shards, 'LATEST')
         end_time = datetime.now() + timedelta(seconds=seconds_running)
         while True:
-            record_response = client.get_records(ShardIterator=iterator)
-            # Only run for a certain amount of time.
-            # Stop looping if no data returned. This means it's done
-            now = datetime.now()
-            if end_time < now:
-                break
-            else:
+            for shard_id, iterator in list(iterators.items()):
+                record_response = client.get_records(ShardIterator=iterator)
                 # yield data to outside calling iterator
                 for record in record_response['Records']:
                     data = record["Data"].decode("utf-8")
@@ -87,63 +264,23 @@ def lambda_handler(event, context):
                     record_id = record["SequenceNumber"]
                     tweet_record = [record_id, timestamp, data]
                     yield tweet_record
-            # Get next iterator for shard from previous request
-            iterator = record_response['NextShardIterator']
-
-    def tweet_to_df(data_frame, id_col):
-        # transform tweet_data field from string to json object, then extract values to list
-        _df_1 = data_frame.tweet_data.apply(json.loads).values.tolist()
-        # create dataframe from extracted values
-        _df_2 = pd.DataFrame.from_records(_df_1)
-        # add id column from initial dataframe to be used in a subsequent join
-        _df_2.insert(0, id_col, pd.Series(data_frame[id_col]))
-        return _df_2
-
-    def merge_df(df1, df2, index_col, drop_col):
-        df1 = df1.set_index(index_col)
-        df2 = df2.set_index(index_col)
-        df3 = pd.merge(df1, df2, how='inner', left_index=True, right_index=True)
-        df = df3.drop(drop_col, axis=1)
-        return df
-
-    @boto_safe_run
-    def save_df_to_s3(df, s3_resource, bucket, filename):
-        """ function that saves contents of a dataframe to S3
-        :param df: source dataframe
-        :param s3_resource: S£resource client
-        :param bucket: target bucket name
-        :param filename: target file key (name)
-        :return: None
-        """
-        csv_buffer = StringIO() # memory buffer to store dataframe data
-        df.to_csv(csv_buffer, header=False)
-        s3_resource.Object(bucket, filename).put(Body=csv_buffer.getvalue())
-
-    def get_file_name(tz, filename):
-        timezone = pytz.timezone(tz)
-        record_time = datetime.now(tz=timezone).strftime("%Y-%m-%d_%H%M%S")
-        _file_name = \
-            "landing/" + \
-            record_time.split("_")[0].split("-")[0] + "/" + \
-            record_time.split("_")[0].split("-")[1] + "/" + \
-            record_time.split("_")[0].split("-")[2] + "/" + \
-            filename + "-" + record_time.split("_")[1] + ".csv"
-        return _file_name
-
-    kinesis_client = boto3.client('kinesis', region_name=aws_region)
-    s3 = boto3.resource('s3')
-
-    my_iterator = get_kinesis_shard_iterator(kinesis_client, stream_name)
-    kinesis_data = subscribe_to_stream(kinesis_client, my_iterator, run_seconds)
-    df_1 = pd.DataFrame(kinesis_data, columns=cols)
-    if df_1.shape[0] > 0:
-        df_2 = tweet_to_df(df_1, id_col)
-        df_3 = merge_df(df_1, df_2, id_col, old_col)
-        full_name = get_file_name(time_zone, file_name)
-        save_df_to_s3(df_3, s3, bucket_name, full_name)
-        count_row = df_3.shape[0]
-        print(f"{count_row} records saved to CSV file on S3")
-    else:
-        print("No new records received from Kinesis data stream")
+                # Get next iterator for shard from previous request, closed shard does not return it
+                next_iterator = record_response.get('NextShardIterator')
+                if next_iterator:
+                    iterators[shard_id] = next_iterator
+                else:
+                    del iterators[shard_id]
+                    iterators.update(get_kinesis_shard_iterators(client, stream_name, known_shards, 'TRIM_HORIZON'))
+            # Only run for a certain amount of time.
+            if end_time < datetime.now():
+                break
+            # keep within the limit of five get_records calls per second per shard
+            time.sleep(0.2)
+
+    kinesis_client = bootstrap.client('kinesis', aws_region)
+    s3 = bootstrap.resource('s3')
+
+    kinesis_data = subscribe_to_stream(kinesis_client, stream_name, run_seconds)
+    save_records(kinesis_data, s3, bucket_name, file_name, time_zone, cols)
 
     return json.dumps({'exit_status':'SUCCESS'})
@@ -1,21 +1,55 @@
-""" Lambda function that creates Kinesis Data Stream. Requires environmental variable
+""" Lambda function that creates Kinesis Data Stream. Number of shards is computed from the configured target write rate
+or, if it is not set, from peak write rate of the stream in previous runs (CloudWatch IncomingBytes and IncomingRecords
+metrics). Requires environmental variable
 :param STREAM_NAME, the name of Kinesis data stream.
+:param TARGET_MB_PER_SEC, optional, expected write rate in MB per second
+:param RATE_LOOKBACK_HOURS, optional, time period in hours to get write rate of previous runs for, default 24
+:param SHARD_HEADROOM, optional, multiplier applied to the expected write rate, default 1.5
+:param MIN_SHARDS, optional, min number of shards, default 1
+:param MAX_SHARDS, optional, max number of shards, default 4
+:param STREAM_TIMEOUT_SECONDS, optional, max time in seconds to wait for the stream to become ACTIVE, default 120
 """
 import json
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-import os
-import time
+import bootstrap
+import config_provider
+import instrumentation
+import kinesis_utils
+import profiling
 
-stream_name = os.environ['STREAM_NAME']
-k_client = boto3.client('kinesis')
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('kinesis-producer-create')
 
 
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
-    
+    stream_name = config['STREAM_NAME']
+    target_mb = config.get('TARGET_MB_PER_SEC')
+    lookback_hours = int(config.get('RATE_LOOKBACK_HOURS', '24'))
+    headroom = float(config.get('SHARD_HEADROOM', '1.5'))
+    min_shards = int(config.get('MIN_SHARDS', '1'))
+    max_shards = int(config.get('MAX_SHARDS', '4'))
+    timeout = int(config.get('STREAM_TIMEOUT_SECONDS', '120'))
+    k_client = bootstrap.client('kinesis')
     print("Stream_name: ", stream_name)
+
+    # compute number of shards from expected write rate
+    if target_mb:
+        bytes_per_sec, records_per_sec = float(target_mb) * kinesis_utils.SHARD_BYTES_PER_SEC, 0
+    else:
+        try:
+            bytes_per_sec, records_per_sec = kinesis_utils.get_peak_ingest_rate(
+                bootstrap.client('cloudwatch'), stream_name, lookback_hours)
+        except ClientError as e:
+            # metrics are only used for sizing, stream is created with min number of shards if they are not available
+            print("CloudWatch returned error: ", e.response['Error']['Message'])
+            bytes_per_sec, records_per_sec = 0, 0
+    shard_count = kinesis_utils.compute_shard_count(bytes_per_sec, records_per_sec, headroom, min_shards, max_shards)
+    print(f"peak write rate {bytes_per_sec:.0f} bytes/s, {records_per_sec:.1f} records/s, shard count {shard_count}")
+
     try:
-        k_client.create_stream(StreamName=stream_name, ShardCount=1)
+        k_client.create_stream(StreamName=stream_name, ShardCount=shard_count)
         print("creating Kinesis stream {0} ".format(stream_name))
     # boto3 error handling using ClientError and ParamValidationError errors.
     except ClientError as e:
@@ -25,21 +59,14 @@ def lambda_handler(event, context):
             raise e
     except ParamValidationError as e:
         raise ValueError(f'The parameters you provided are incorrect: {e}')
-        
-    try:    
-        stream_info = k_client.describe_stream(StreamName=stream_name)
-        stream_desc = stream_info["StreamDescription"]
-        stream_status = stream_desc["StreamStatus"]
-        while stream_status != "ACTIVE":
-            time.sleep(3)
-            stream_info = k_client.describe_stream(StreamName=stream_name)
-            stream_desc = stream_info["StreamDescription"]
-            stream_status = stream_desc["StreamStatus"]
-            print("{0} status is {1}".format(stream_name, stream_status))
+
+    try:
+        waited = kinesis_utils.wait_for_stream_active(k_client, stream_name, timeout)
+        print("{0} status is ACTIVE after {1:.1f} seconds".format(stream_name, waited))
     except ClientError as e:
         print("Kinesis stream returned error: ", e.response['Error']['Message'])
         raise e
     except ParamValidationError as e:
         raise ValueError(f'The parameters you provided are incorrect: {e}')
-        
-    return json.dumps({"exit_status":"SUCCESS"})
\ No newline at end of file
+
+    return json.dumps({"exit_status": "SUCCESS", "shard_count": shard_count})
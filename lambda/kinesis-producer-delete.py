@@ -1,40 +1,37 @@
-""" Lambda function that creates Kinesis Data Stream. Requires environmental variable
+""" Lambda function that deletes Kinesis Data Stream and waits until deletion is completed. Requires environmental variable
 :param STREAM_NAME, the name of Kinesis data stream.
+:param STREAM_TIMEOUT_SECONDS, optional, max time in seconds to wait for the stream to be deleted, default 120
 """
 import json
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-import os
+import bootstrap
+import config_provider
+import instrumentation
+import kinesis_utils
+import profiling
 
-stream_name = os.environ['STREAM_NAME']
-k_client = boto3.client('kinesis')
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('kinesis-producer-delete')
 
 
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
-    
+    stream_name = config['STREAM_NAME']
+    timeout = int(config.get('STREAM_TIMEOUT_SECONDS', '120'))
+    k_client = bootstrap.client('kinesis')
     print("Stream_name: ", stream_name)
-    
+
     try:
         k_client.delete_stream(StreamName=stream_name, EnforceConsumerDeletion=True)
+        waited = kinesis_utils.wait_for_stream_deleted(k_client, stream_name, timeout)
     # boto3 error handling using ClientError and ParamValidationError errors.
     except ClientError as e:
         print("Kinesis stream returned error: ", e.response['Error']['Message'])
         raise e
     except ParamValidationError as e:
-        raise ValueError(f'The parameters you provided are incorrect: {e}')    
-    
-    deleted = False
-    while not deleted:
-        try:
-            response = k_client.list_streams(Limit=20, ExclusiveStartStreamName=stream_name)
-            _stream = response["StreamNames"][0]
-            if _stream == stream_name:
-                deleted = False
-            else:
-                deleted = True
-        except IndexError:
-            deleted = True
+        raise ValueError(f'The parameters you provided are incorrect: {e}')
+
+    print(f"data stream {stream_name} DELETED after {waited:.1f} seconds")
 
-    print(f"data stream {stream_name} DELETED")
-    
-    return json.dumps({'exit_status':'SUCCESS'})
\ No newline at end of file
+    return json.dumps({'exit_status':'SUCCESS'})
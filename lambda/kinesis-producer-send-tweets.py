@@ -4,24 +4,34 @@ using MyStreamListener class from stream_listener.py. It requires environmental
 :param TWITTER_API_ENDPOINT, Twitter streaming API endpoint URL (https://api.twitter.com/labs/1/tweets/stream/sample)
 :param STREAM_NAME, the name of Kinesis data stream
 :param STREAM_SECONDS, activity time in seconds for Kinesis producer
+:param MAX_SHARDS, optional, max number of shards the stream can be resharded to when writes are throttled, default 4
+:param RESHARD_THROTTLE_LIMIT, optional, number of throttled writes after which the stream is resharded, default 10
 """
 import json
-import boto3
-import os
 import tweepy
 import stream_listener
+import bootstrap
+import config_provider
+import instrumentation
+import profiling
 
-aws_region = os.environ['MY_AWS_REGION']
-url = os.environ['TWITTER_API_ENDPOINT']
-stream_name = os.environ['STREAM_NAME']
-time_limit_cnf = int(os.environ['STREAM_SECONDS'])
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('kinesis-producer-send-tweets')
 
 
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
-    
-    k_client = boto3.client('kinesis')
+    aws_region = config['MY_AWS_REGION']
+    stream_name = config['STREAM_NAME']
+    time_limit_cnf = int(config['STREAM_SECONDS'])
+    max_shards = int(config.get('MAX_SHARDS', '4'))
+    throttle_limit = int(config.get('RESHARD_THROTTLE_LIMIT', '10'))
+
+    # stream listener retries throttled writes itself and counts them to reshard the stream, boto3 retries are disabled
+    k_client = bootstrap.client('kinesis', max_attempts=1)
     # load Twitter credentials from AWS Parameter Store
-    ssm = boto3.client("ssm", region_name=aws_region)
+    ssm = bootstrap.client("ssm", aws_region)
     tokens = ssm.get_parameter(Name="/data-stream/twitter/token", WithDecryption=True)['Parameter']['Value']
     tokens_list = tokens.split(",")
     key = tokens_list[0]
@@ -33,7 +43,7 @@ def lambda_handler(event, context):
     auth.set_access_token(token, token_secret)
     api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
     
-    stream = stream_listener.MyStreamListener(api, time_limit_cnf, k_client, stream_name)
+    stream = stream_listener.MyStreamListener(api, time_limit_cnf, k_client, stream_name, max_shards, throttle_limit)
     tweet_stream = tweepy.Stream(auth=api.auth, listener=stream, tweet_mode='extended')
     tweet_stream.sample()
     
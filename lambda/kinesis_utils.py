@@ -0,0 +1,122 @@
+""" Python script with Kinesis Data Stream helpers used by kinesis-producer-create, kinesis-producer-delete Lambda functions
+and MyStreamListener class. It provides shard count sizing from recent ingest rates, waiting for stream status changes
+with exponential backoff and timeout, and stream resharding.
+"""
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+
+# Kinesis write limits of a single shard
+SHARD_BYTES_PER_SEC = 1024 * 1024
+SHARD_RECORDS_PER_SEC = 1000
+
+
+def wait_until(check, timeout, initial_delay=0.5, max_delay=8, description="condition"):
+    """ function that calls check function with exponentially growing delay until it returns True or timeout is reached.
+    It takes input
+    :param check: function without arguments that returns True when waiting is finished
+    :param timeout: max waiting time in seconds
+    :param initial_delay: delay in seconds before the second check
+    :param max_delay: max delay in seconds between two checks
+    :param description: description of the condition used in error message
+    :return: number of seconds spent waiting
+    """
+    start = time.monotonic()
+    delay = initial_delay
+    while not check():
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            raise TimeoutError(f"{description} not reached in {timeout} seconds")
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, max_delay)
+    return time.monotonic() - start
+
+
+def get_stream_status(client, stream_name):
+    """ function that returns current status of the stream
+    :param client: Kinesis service client
+    :param stream_name: the name of Kinesis data stream
+    :return: stream status string, None if stream does not exist
+    """
+    try:
+        response = client.describe_stream_summary(StreamName=stream_name)
+        return response['StreamDescriptionSummary']['StreamStatus']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise e
+
+
+def wait_for_stream_active(client, stream_name, timeout):
+    """ function that waits until the stream is ACTIVE
+    :param client: Kinesis service client
+    :param stream_name: the name of Kinesis data stream
+    :param timeout: max waiting time in seconds
+    :return: number of seconds spent waiting
+    """
+    return wait_until(lambda: get_stream_status(client, stream_name) == 'ACTIVE', timeout,
+                      description=f"stream {stream_name} ACTIVE status")
+
+
+def wait_for_stream_deleted(client, stream_name, timeout):
+    """ function that waits until the stream does not exist
+    :param client: Kinesis service client
+    :param stream_name: the name of Kinesis data stream
+    :param timeout: max waiting time in seconds
+    :return: number of seconds spent waiting
+    """
+    return wait_until(lambda: get_stream_status(client, stream_name) is None, timeout,
+                      description=f"stream {stream_name} deletion")
+
+
+def get_peak_ingest_rate(cw_client, stream_name, lookback_hours):
+    """ function that retrieves peak per second write rate of the stream from CloudWatch IncomingBytes and IncomingRecords
+    metrics of previous runs. Metrics are kept by CloudWatch after the stream has been deleted. It takes input
+    :param cw_client: CloudWatch service client
+    :param stream_name: the name of Kinesis data stream
+    :param lookback_hours: time period in hours to get the metrics for
+    :return: tuple of peak bytes per second and peak records per second, zeros if there is no data
+    """
+    end = datetime.now(tz=timezone.utc)
+    start = end - timedelta(hours=lookback_hours)
+    rates = []
+    for metric in ('IncomingBytes', 'IncomingRecords'):
+        response = cw_client.get_metric_statistics(Namespace='AWS/Kinesis', MetricName=metric,
+                                                   Dimensions=[{'Name': 'StreamName', 'Value': stream_name}],
+                                                   StartTime=start, EndTime=end, Period=60, Statistics=['Sum'])
+        peak = max((point['Sum'] for point in response['Datapoints']), default=0)
+        rates.append(peak / 60)
+    return rates[0], rates[1]
+
+
+def compute_shard_count(bytes_per_sec, records_per_sec, headroom=1.5, min_shards=1, max_shards=4):
+    """ function that computes number of shards required for the write rate, using per shard write limits. It takes input
+    :param bytes_per_sec: expected write rate in bytes per second
+    :param records_per_sec: expected write rate in records per second
+    :param headroom: multiplier applied to the expected rate
+    :param min_shards: min number of shards
+    :param max_shards: max number of shards
+    :return: number of shards
+    """
+    required = max(math.ceil(bytes_per_sec * headroom / SHARD_BYTES_PER_SEC),
+                   math.ceil(records_per_sec * headroom / SHARD_RECORDS_PER_SEC))
+    return max(min_shards, min(max_shards, required))
+
+
+def reshard(client, stream_name, target_shards):
+    """ function that changes the number of shards of an ACTIVE stream. Stream stays writable while it is UPDATING
+    :param client: Kinesis service client
+    :param stream_name: the name of Kinesis data stream
+    :param target_shards: new number of shards
+    :return: True if resharding has been started, False if the stream is already being updated
+    """
+    try:
+        client.update_shard_count(StreamName=stream_name, TargetShardCount=target_shards, ScalingType='UNIFORM_SCALING')
+        print(f"resharding {stream_name} to {target_shards} shards")
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('ResourceInUseException', 'LimitExceededException'):
+            print("Kinesis stream returned error: ", e.response['Error']['Message'])
+            return False
+        raise e
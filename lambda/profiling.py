@@ -0,0 +1,139 @@
+""" Python script with opt-in profiling of Lambda handler invocations. When profiling is enabled every Nth invocation
+of the container is run under cProfile and/or tracemalloc and the reports are written to a local directory or S3 prefix:
+    <handler>_<time>_<request id>.pstats - cProfile statistics, readable with pstats module
+    <handler>_<time>_<request id>.alloc.json - peak traced memory and top allocation sites
+benchmarks/profile_summary.py merges collected reports. Profiling is configured when the handler module is loaded,
+a disabled decorator returns the handler unchanged, so there is no overhead. Only the handler process is profiled,
+transform worker processes are not. It reads optional environmental variables
+:param PROFILE_MODE, 'off', 'cpu' (cProfile), 'memory' (tracemalloc) or 'all', default 'off'
+:param PROFILE_EVERY, profile every Nth invocation of the container, default 1
+:param PROFILE_PATH, local directory or 's3://bucket/prefix/' to write reports to, default '/tmp/profiles/'
+:param PROFILE_TOP, number of top allocation sites in memory report, default 25
+:param PROFILE_FRAMES, number of stack frames stored by tracemalloc for each allocation, default 1
+"""
+import functools
+import itertools
+import json
+import marshal
+import os
+import tempfile
+import time
+import tracemalloc
+import cProfile
+import bootstrap
+
+MODES = ('cpu', 'memory', 'all')
+
+
+def get_settings():
+    """ function that reads profiling configuration
+    :return: dictionary with configuration values, None if profiling is disabled
+    """
+    mode = os.environ.get('PROFILE_MODE', 'off').lower()
+    if mode not in MODES:
+        return None
+    return {
+        "cpu": mode in ('cpu', 'all'),
+        "memory": mode in ('memory', 'all'),
+        "every": max(1, int(os.environ.get('PROFILE_EVERY', '1'))),
+        "path": os.environ.get('PROFILE_PATH', os.path.join(tempfile.gettempdir(), 'profiles', '')),
+        "top": int(os.environ.get('PROFILE_TOP', '25')),
+        "frames": int(os.environ.get('PROFILE_FRAMES', '1')),
+    }
+
+
+def write_report(path, name, data):
+    """ function that writes profiling report to local directory or S3 prefix. It takes input
+    :param path: local directory or 's3://bucket/prefix/'
+    :param name: report file name
+    :param data: report bytes
+    :return: location of the written report
+    """
+    if path.startswith('s3://'):
+        bucket, _, prefix = path[len('s3://'):].partition('/')
+        key = prefix.rstrip('/') + '/' + name if prefix else name
+        bootstrap.client('s3').put_object(Bucket=bucket, Key=key, Body=data)
+        return f"s3://{bucket}/{key}"
+    os.makedirs(path, exist_ok=True)
+    location = os.path.join(path, name)
+    with open(location, 'wb') as f:
+        f.write(data)
+    return location
+
+
+def allocation_report(snapshot, peak, top):
+    """ function that builds report of top allocation sites from tracemalloc snapshot. It takes input
+    :param snapshot: tracemalloc Snapshot taken at the end of the invocation
+    :param peak: peak traced memory in bytes
+    :param top: number of allocation sites in the report
+    :return: dictionary with peak memory and allocation sites sorted by size
+    """
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    stats = snapshot.statistics('lineno')
+    return {
+        "peak_bytes": peak,
+        "traced_bytes": sum(s.size for s in stats),
+        "top": [{"location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                 "size_bytes": s.size, "count": s.count} for s in stats[:top]],
+    }
+
+
+def _base_name(func, context, invocation):
+    # reports are tagged with handler name, invocation time and request id
+    request_id = getattr(context, 'aws_request_id', None) or f"local-{os.getpid()}-{invocation}"
+    run_time = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+    return f"{func.__module__}.{func.__name__}_{run_time}_{request_id}"
+
+
+def profiled(func):
+    """ decorator of Lambda handler that profiles sampled invocations, it returns the handler unchanged when profiling
+    is disabled. Reports are written after the handler has returned or failed, errors of writing them are printed and
+    do not fail the invocation
+    :param func: Lambda handler function
+    :return: decorated handler
+    """
+    settings = get_settings()
+    if settings is None:
+        return func
+    invocations = itertools.count()
+
+    @functools.wraps(func)
+    def inner_function(event, context):
+        invocation = next(invocations)
+        if invocation % settings["every"]:
+            return func(event, context)
+        profiler = cProfile.Profile() if settings["cpu"] else None
+        # tracemalloc may already be started by the caller, eg. a benchmark, it is left running in that case
+        trace_memory = settings["memory"] and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start(settings["frames"])
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is active in this process
+                profiler = None
+        try:
+            return func(event, context)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot() if settings["memory"] and tracemalloc.is_tracing() else None
+            peak = tracemalloc.get_traced_memory()[1] if snapshot is not None else 0
+            if trace_memory:
+                tracemalloc.stop()
+            base_name = _base_name(func, context, invocation)
+            try:
+                if profiler is not None:
+                    profiler.create_stats()
+                    # marshal format of pstats files, same as Profile.dump_stats()
+                    location = write_report(settings["path"], base_name + '.pstats', marshal.dumps(profiler.stats))
+                    print(f"CPU profile saved to {location}")
+                if snapshot is not None:
+                    report = allocation_report(snapshot, peak, settings["top"])
+                    location = write_report(settings["path"], base_name + '.alloc.json',
+                                            json.dumps(report, indent=2).encode('utf-8'))
+                    print(f"allocation report saved to {location}, peak traced memory {peak} bytes")
+            except Exception as e:
+                print(f"Profiling report could not be saved: {e}")
+    return inner_function
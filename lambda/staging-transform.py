@@ -1,5 +1,14 @@
 """ Lambda function that loads data from the S3 Landing zone applies necessary transformations and and saves it to Staging
-zone. Function also return indicators of data processing to be used by update-data-log Lambda. It requires environmental variables
+zone. Function also return indicators of data processing to be used by update-data-log Lambda.
+lambda_handler processes landing files of the current day, backfill_handler reprocesses a range of past days one day per
+work unit, either in a local process pool or in Map state of StagingBackfillStateMachine. Every day is written to its own
+staging object, so reprocessing a day overwrites its previous output, and finished days are recorded in a progress log
+so that interrupted backfill is resumed. Row transformations can run in several processes on contiguous shards of the
+loaded data (TRANSFORM_WORKERS), shards are combined in their original order so the output does not depend on the
+number of workers. fanout_handler splits processing of a day with large amount of landing data between several
+invocations: a plan step assigns slices of landing files to workers of Map state of LandingAnalyticalStateMachine, each
+worker transforms its slice into a partial output and a merge step combines partial outputs into the Staging object.
+It requires environmental variables
 :param ACCOUNT_ID, user account id.
 :param TARGET_DB, the name of target (Staging) database in Glue Catalog
 :param TARGET_TABLE, the name of target (Staging) table in Glue Catalog
@@ -11,250 +20,770 @@ zone. Function also return indicators of data processing to be used by update-da
 :param STAGING_FILE, base string to use in the exported file name
 :param TIME_ZONE, UTC timezone abbreviation to be used as home timezone, eg. 'Europe/Helsinki'
 :param TIME_HORIZONT_HRS, time filter to apply when loading daily data from Landing zone'
+:param ROLLUP_PATH, optional, S3 path of analytical.hashtag_rollup table, hashtag rollups are computed only if it is set
+:param ROLLUP_SNAPSHOT_PATH, optional, S3 path where mergeable rollup sketch snapshots are saved, default ROLLUP_PATH + '_snapshots/'
+:param ROLLUP_BUCKET_MINUTES, optional, size of rollup time bucket in minutes, default 60
+:param ROLLUP_TOP_K, optional, number of top hashtags kept per time bucket, default 100
+:param ROLLUP_EPS, optional, relative error bound of Count-Min hashtag count estimates, default 0.01
+:param BACKFILL_LOG_PATH, optional, S3 path of backfill progress log, default STAGING_PATH + '_backfill_log/'
+:param TRANSFORM_WORKERS, optional, number of transform processes, 'auto' for one per CPU, default 1
+:param SENTIMENT_CACHE_SIZE, optional, number of cleaned texts whose sentiment is cached, default 65536. It is read
+from Lambda environment only, not from config table, since the cache is created when the module is imported
+:param FANOUT_PATH, optional, S3 path of fan-out plans and partial outputs, default STAGING_PATH + '_fanout/'
+:param FANOUT_WORKERS, optional, number of fan-out worker invocations, default 4
 """
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import importlib.util
 import json
+import multiprocessing
+import pickle
 import os
-import pandas as pd
-import numpy as np
 import base64
 import hashlib
 from datetime import datetime, timedelta
-from dateutil.parser import *
 import pytz
 from io import StringIO
-from textblob import TextBlob
 import re
+import bootstrap
+import config_provider
+import hashtag_sketch
+import instrumentation
+import profiling
 
-account_id = os.environ['ACCOUNT_ID']
-target_db = os.environ['TARGET_DB']
-target_table = os.environ['TARGET_TABLE']
-source_db = os.environ['SOURCE_DB']
-source_table = os.environ['SOURCE_TABLE']
-bucket_name = os.environ['BUCKET_NAME']
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('staging-transform')
+# heavy libraries are imported on first use to keep them out of module load time
+pd = bootstrap.lazy_import('pandas')
+np = bootstrap.lazy_import('numpy')
+textblob = bootstrap.lazy_import('textblob')
+parser = bootstrap.lazy_import('dateutil.parser')
+# optional dependency used to send transformed shards from worker processes
+if importlib.util.find_spec('pyarrow') is not None:
+    pyarrow = bootstrap.lazy_import('pyarrow')
+    pa_ipc = bootstrap.lazy_import('pyarrow.ipc')
+else:
+    pyarrow = pa_ipc = None
 
-landing_path = os.environ['LANDING_PATH']
-staging_path = os.environ['STAGING_PATH']
-staging_file = os.environ['STAGING_FILE']
-timezone = pytz.timezone(os.environ['TIME_ZONE'])
-time_horizon = int(os.environ['TIME_HORIZONT_HRS'])
 
+def boto_safe_run(func):
+    """ decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
+    :param func: outer function to be passed to decorator
+    :return: executed inner function
+    """
 
-def lambda_handler(event, context):
-    def boto_safe_run(func):
-        """ decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
-        :param func: outer function to be passed to decorator
-        :return: executed inner function
-        """
-
-        def inner_function(*args, **kwargs):
-            # inner function that uses arguments of the outer function runs it applying error handling functionality
-            try:
-                return func(*args, *kwargs)
-            except ClientError as e:
-                print("AWS client returned error: ", e.response['Error']['Message'])
-                raise e
-            except ParamValidationError as e:
-                raise ValueError(f'The parameters you provided are incorrect: {e}')
-
-        return inner_function
-
-    @boto_safe_run
-    def get_glue_schema(client, id, db, table, partitioned):
-        """ function that retrieves table schema information from Glue Catalog. It requires the following input
-        :param client: Glue client
-        :param id: Glue Catalog id
-        :param db: the name of the database in Glue Catalog
-        :param table: the name of the table in Glue Catalog
-        :param partitioned: boolean variable indicating if the table is partitioned
-        :return: list of table column names
-        """
-        # get table metadata from Glue Catalog
-        response_stg = client.get_table(CatalogId=id, DatabaseName=db, Name=table)
-        if partitioned:
-            col_list_stg = []
-            part_list = []
-            # get partition and column list from Glue Catalog
-            columns = response_stg['Table']['StorageDescriptor']['Columns']
-            part_columns = response_stg['Table']['PartitionKeys']
-            for col in columns:
-                col_list_stg.append(col['Name'])
-
-            for col in part_columns:
-                part_list.append(col['Name'])
-
-            col_list_stg += part_list
-        else:
-            # only get get column list from Glue Catalog
-            col_list_stg = []
-            columns = response_stg['Table']['StorageDescriptor']['Columns']
-            for col in columns:
-                col_list_stg.append(col['Name'])
-        return col_list_stg
-
-    @boto_safe_run
-    def filter_s3_objs(client, bucket, prefix, tz, t_horizon):
-        """ function that creates filtered file object list from S3 bucket using provided time range value
-        :param client: S3 client
-        :param bucket: S3 bucket
-        :param prefix: prefix of the file objects keys used in filtering
-        :param tz: local timezone
-        :param t_horizon: time in hours used to determine time range filter from current hour
-        :return: list of S3 file object keys
-        """
-        keys_filtered = []
-        # get unfiltered object list
-        ts_start = datetime.now(tz=tz) - timedelta(hours=t_horizon)
-        # from_hour = int(datetime.now(tz=tz).strftime("%H")) - t_horizon
-        response = client.list_objects(
-            Bucket=bucket,
-            Prefix=prefix
-        )
-        objs = response["Contents"]
+    def inner_function(*args, **kwargs):
+        # inner function that uses arguments of the outer function runs it applying error handling functionality
+        try:
+            return func(*args, **kwargs)
+        except ClientError as e:
+            print("AWS client returned error: ", e.response['Error']['Message'])
+            raise e
+        except ParamValidationError as e:
+            raise ValueError(f'The parameters you provided are incorrect: {e}')
+
+    return inner_function
+
+
+@boto_safe_run
+def get_glue_schema(client, id, db, table, partitioned):
+    """ function that retrieves table schema information from Glue Catalog. It requires the following input
+    :param client: Glue client
+    :param id: Glue Catalog id
+    :param db: the name of the database in Glue Catalog
+    :param table: the name of the table in Glue Catalog
+    :param partitioned: boolean variable indicating if the table is partitioned
+    :return: list of table column names
+    """
+    # get table metadata from Glue Catalog
+    response_stg = client.get_table(CatalogId=id, DatabaseName=db, Name=table)
+    if partitioned:
+        col_list_stg = []
+        part_list = []
+        # get partition and column list from Glue Catalog
+        columns = response_stg['Table']['StorageDescriptor']['Columns']
+        part_columns = response_stg['Table']['PartitionKeys']
+        for col in columns:
+            col_list_stg.append(col['Name'])
+
+        for col in part_columns:
+            part_list.append(col['Name'])
+
+        col_list_stg += part_list
+    else:
+        # only get get column list from Glue Catalog
+        col_list_stg = []
+        columns = response_stg['Table']['StorageDescriptor']['Columns']
+        for col in columns:
+            col_list_stg.append(col['Name'])
+    return col_list_stg
+
+
+@boto_safe_run
+def filter_s3_objs(client, bucket, prefix, tz, t_horizon):
+    """ function that creates filtered file object list from S3 bucket using provided time range value
+    :param client: S3 client
+    :param bucket: S3 bucket
+    :param prefix: prefix of the file objects keys used in filtering
+    :param tz: local timezone
+    :param t_horizon: time in hours used to determine time range filter from current hour
+    :return: list of S3 file object keys, empty list if there are no objects in the time range
+    """
+    keys_filtered = []
+    ts_start = datetime.now(tz=tz) - timedelta(hours=t_horizon)
+    # get unfiltered object list, a single list call returns at most 1000 keys and no Contents for an empty prefix
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
         # filter objects by LastModified timestamp data
-        for ob in objs:
+        for ob in page.get("Contents", []):
             modified = ob.get("LastModified")
-            # hour = modified.astimezone(timezone).strftime('%H')
             if modified >= ts_start:
                 name = ob.get("Key")
                 keys_filtered.append(name)
-        return keys_filtered
-
-    @boto_safe_run
-    def load_from_s3(s3, bucket, file_keys, cols):
-        """ funstion that loads file objects from S3 using provided list of object keys and
-        saves them to a single Pandas dataframe
-        :param s3: S3 client
-        :param bucket: name of S3 bucket
-        :param file_keys: list of keys
-        :param cols: list of dataframe column names
-        :return: Pandas dataframe
-        """
-        df_list = []
-        # iterate over object list and load files to memory
-        for file in file_keys:
-            body = s3.get_object(Bucket=bucket, Key=file)["Body"].read().decode('utf-8')
-
-            # create single object dataframe and append it to the list of dataframes
-            df_single = pd.read_csv(StringIO(body), names=cols)
-            df_list.append(df_single)
-        # create resulting dataframe from the list of dataframes
-        return pd.concat(df_list, axis=0, ignore_index=True)
-
-    @boto_safe_run
-    def save_df_to_s3(df, s3_resource, bucket, filename):
-        csv_buffer = StringIO()  # memory buffer to store dataframe data
-        df.to_csv(csv_buffer, header=False, index=False)
-        s3_resource.Object(bucket, filename).put(Body=csv_buffer.getvalue())
-
-    def clean_tweet(string):
-        """ function that cleans input string from symbols and abbreviations without verbal meaning, in order to use it
-        for text sentiment analysis. It takes input
-        :param string: string of the tweet text
-        :return: processed text string
-        """
-        # Using regular expression filtering clean text for url addresses, quotes, non alfanumeric Latin characters
-        string = re.sub(r"^(http\S+|ftp|file):\\/\\/[-a-zA-Z0-9+&@#\\/%?=~_|!:,.;]*[-a-zA-Z0-9+&@#\\/%=~_|]", "",
-                        str(string), flags=re.MULTILINE)
-        string = re.sub(r"\"", "", str(string), flags=re.MULTILINE)
-        string = re.sub(r"https\S+", "", str(string), flags=re.MULTILINE)
-        string = re.sub(r"RT", "", str(string), flags=re.MULTILINE)
-        string = re.sub(r"amp", "", str(string), flags=re.MULTILINE)
-        string = re.sub(r"[^\u0000-\uFFFF]", "", str(string), flags=re.MULTILINE)
-        string = re.sub(r"([^\w\s]+)", " ", str(string), flags=re.MULTILINE)
-        # compile emoji-like symbol pattern
-        emoji_pattern = re.compile("["
-                                   u"\U0001F600-\U0001F64F"  # emoticons
-                                   u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                                   u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                                   u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                                   u"\U00002702-\U000027B0"
-                                   u"\U000024C2-\U0001F251"
-                                   "]+", flags=re.UNICODE)
-        # filter emoji pattern and line breaks
-        string = emoji_pattern.sub(r'', string).replace("\n", "")
-        return string
-
-    # simple function that cleans hashtags from non-alphanumeric Latin characters
-    def clean_hashtags(hashtag):
-        hashtag = re.sub(r'([^A-Za-z0-9\s]+)', '', str(hashtag))
-        return hashtag
-
-    # function that calculates sentiment and polarity of input text using TextBlob library tools
-    def text_sentiment(text):
-        sentiment = ' '.join(str(s) for s in TextBlob(text).sentiment)
-        return sentiment
-
-    # function that generates hash key from the input string
-    def generate_hash_key(x):
-        return base64.b64encode(hashlib.sha1(x).digest())
-
-    # next four functions parse timestamp strings and return the required ts format, they are used in the dataframe
-    # column mapping (.apply()) operations
-    def get_year(x):
-        parsed_date = parse(x)
-        return parsed_date.year
-
-    def get_month(x):
-        parsed_date = parse(x)
-        return parsed_date.month
-
-    def get_day(x):
-        parsed_date = parse(x)
-        return parsed_date.day
-
-    def get_timestamp(date):
-        parsed_date = parse(date).strftime('%Y-%m-%d %H:%M:%S')
-        return parsed_date
-
-    # initiate AWS service clients
-    s3 = boto3.resource('s3')
-    s3_client = boto3.client("s3")
-    g_client = boto3.client('glue')
-
-    record_time = datetime.now(tz=timezone).strftime("%Y-%m-%d")
-
-    prefix_string = landing_path + \
-                    record_time.split("-")[0] + "/" + \
-                    record_time.split("-")[1] + "/" + \
-                    record_time.split("-")[2] + "/"
-    # get column names from Glue Catalog
-    old_cols = get_glue_schema(g_client, account_id, source_db, source_table, partitioned=False)
-    new_cols = get_glue_schema(g_client, account_id, target_db, target_table, partitioned=True)
-    # get filtered file list from S3 and create dataframe from its files
-    files = filter_s3_objs(s3_client, bucket_name, prefix_string, timezone, time_horizon)
-    frame = load_from_s3(s3_client, bucket_name, files, old_cols)
-    # carry out necessary transformations on the landing data
+    return keys_filtered
+
+
+@boto_safe_run
+def load_from_s3(s3, bucket, file_keys, cols, dtype=None):
+    """ funstion that loads file objects from S3 using provided list of object keys and
+    saves them to a single Pandas dataframe
+    :param s3: S3 client
+    :param bucket: name of S3 bucket
+    :param file_keys: list of keys
+    :param cols: list of dataframe column names
+    :param dtype: optional column type passed to read_csv, eg. str to keep values exactly as they are in the files
+    :return: Pandas dataframe
+    """
+    df_list = []
+    # iterate over object list and load files to memory
+    for file in file_keys:
+        body = s3.get_object(Bucket=bucket, Key=file)["Body"].read().decode('utf-8')
+        metrics.add("BytesRead", len(body), "Bytes")
+        if not body:
+            # empty objects have no csv header to parse
+            continue
+
+        # create single object dataframe and append it to the list of dataframes
+        df_single = pd.read_csv(StringIO(body), names=cols, dtype=dtype)
+        df_list.append(df_single)
+    if not df_list:
+        return pd.DataFrame(columns=cols)
+    # create resulting dataframe from the list of dataframes
+    return pd.concat(df_list, axis=0, ignore_index=True)
+
+
+@boto_safe_run
+def save_df_to_s3(df, s3_resource, bucket, filename):
+    csv_buffer = StringIO()  # memory buffer to store dataframe data
+    df.to_csv(csv_buffer, header=False, index=False)
+    body = csv_buffer.getvalue()
+    s3_resource.Object(bucket, filename).put(Body=body)
+    metrics.add("BytesWritten", len(body), "Bytes")
+
+
+def clean_tweet(string):
+    """ function that cleans input string from symbols and abbreviations without verbal meaning, in order to use it
+    for text sentiment analysis. It takes input
+    :param string: string of the tweet text
+    :return: processed text string
+    """
+    # Using regular expression filtering clean text for url addresses, quotes, non alfanumeric Latin characters
+    string = re.sub(r"^(http\S+|ftp|file):\\/\\/[-a-zA-Z0-9+&@#\\/%?=~_|!:,.;]*[-a-zA-Z0-9+&@#\\/%=~_|]", "",
+                    str(string), flags=re.MULTILINE)
+    string = re.sub(r"\"", "", str(string), flags=re.MULTILINE)
+    string = re.sub(r"https\S+", "", str(string), flags=re.MULTILINE)
+    string = re.sub(r"RT", "", str(string), flags=re.MULTILINE)
+    string = re.sub(r"amp", "", str(string), flags=re.MULTILINE)
+    string = re.sub(r"[^\u0000-\uFFFF]", "", str(string), flags=re.MULTILINE)
+    string = re.sub(r"([^\w\s]+)", " ", str(string), flags=re.MULTILINE)
+    # compile emoji-like symbol pattern
+    emoji_pattern = re.compile("["
+                               u"\U0001F600-\U0001F64F"  # emoticons
+                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+                               u"\U00002702-\U000027B0"
+                               u"\U000024C2-\U0001F251"
+                               "]+", flags=re.UNICODE)
+    # filter emoji pattern and line breaks
+    string = emoji_pattern.sub(r'', string).replace("\n", "")
+    return string
+
+
+# simple function that cleans hashtags from non-alphanumeric Latin characters
+def clean_hashtags(hashtag):
+    hashtag = re.sub(r'([^A-Za-z0-9\s]+)', '', str(hashtag))
+    return hashtag
+
+
+@boto_safe_run
+def save_rollups(rollups, s3_resource, bucket, table_path, snapshot_path, name):
+    """ function that saves top hashtags of each time bucket to hashtag_rollup table location in csv format and
+    mergeable sketch snapshots of the buckets in json format. It takes input
+    :param rollups: dictionary of bucket start and HashtagRollup object
+    :param s3_resource: S3 resource client
+    :param bucket: name of S3 bucket
+    :param table_path: S3 path of hashtag_rollup table
+    :param snapshot_path: S3 path of sketch snapshots
+    :param name: name used in file names, staging partition day or run id that starts with it
+    :return: number of rows saved
+    """
+    rows = [row for b in sorted(rollups) for row in rollups[b].rows()]
+    csv_buffer = StringIO()
+    pd.DataFrame(rows).to_csv(csv_buffer, header=False, index=False)
+    s3_resource.Object(bucket, table_path + 'hashtag_rollup_' + name + '.csv').put(Body=csv_buffer.getvalue())
+    snapshots = json.dumps([rollups[b].to_dict() for b in sorted(rollups)])
+    s3_resource.Object(bucket, snapshot_path + 'hashtag_rollup_' + name + '.json').put(Body=snapshots)
+    metrics.add("BytesWritten", len(csv_buffer.getvalue()) + len(snapshots), "Bytes")
+    return len(rows)
+
+
+# function that calculates sentiment and polarity of input text using TextBlob library tools, retweets repeat the same
+# texts many times, so results are cached for the lifetime of the container
+@functools.lru_cache(maxsize=int(os.environ.get('SENTIMENT_CACHE_SIZE', '65536')))
+def text_sentiment(text):
+    sentiment = ' '.join(str(s) for s in textblob.TextBlob(text).sentiment)
+    return sentiment
+
+
+# function that generates hash key from the input string
+def generate_hash_key(x):
+    return base64.b64encode(hashlib.sha1(x).digest())
+
+
+# next four functions parse timestamp strings and return the required ts format, they are used in the dataframe
+# column mapping (.apply()) operations
+def get_year(x):
+    parsed_date = parser.parse(x)
+    return parsed_date.year
+
+
+def get_month(x):
+    parsed_date = parser.parse(x)
+    return parsed_date.month
+
+
+def get_day(x):
+    parsed_date = parser.parse(x)
+    return parsed_date.day
+
+
+def get_timestamp(date):
+    parsed_date = parser.parse(date).strftime('%Y-%m-%d %H:%M:%S')
+    return parsed_date
+
+
+def load_settings():
+    """ function that reads configuration of this Lambda. Settings are returned as a plain dictionary so that they
+    can be passed to worker processes
+    :return: dictionary with configuration values
+    """
+    staging_path = config['STAGING_PATH']
+    rollup_path = config.get('ROLLUP_PATH')
+    return {
+        "account_id": config['ACCOUNT_ID'],
+        "target_db": config['TARGET_DB'],
+        "target_table": config['TARGET_TABLE'],
+        "source_db": config['SOURCE_DB'],
+        "source_table": config['SOURCE_TABLE'],
+        "bucket_name": config['BUCKET_NAME'],
+        "landing_path": config['LANDING_PATH'],
+        "staging_path": staging_path,
+        "staging_file": config['STAGING_FILE'],
+        "time_zone": config['TIME_ZONE'],
+        "time_horizon": int(config['TIME_HORIZONT_HRS']),
+        "rollup_path": rollup_path,
+        "rollup_snapshot_path": config.get('ROLLUP_SNAPSHOT_PATH', (rollup_path or '').rstrip('/') + '_snapshots/'),
+        "rollup_bucket_minutes": int(config.get('ROLLUP_BUCKET_MINUTES', '60')),
+        "rollup_top_k": int(config.get('ROLLUP_TOP_K', '100')),
+        "rollup_eps": float(config.get('ROLLUP_EPS', '0.01')),
+        "backfill_log_path": config.get('BACKFILL_LOG_PATH', staging_path.rstrip('/') + '_backfill_log/'),
+        "transform_workers": get_worker_count(config.get('TRANSFORM_WORKERS', '1')),
+        "fanout_path": config.get('FANOUT_PATH', staging_path.rstrip('/') + '_fanout/'),
+        "fanout_workers": max(1, int(config.get('FANOUT_WORKERS', '4'))),
+    }
+
+
+def get_worker_count(value):
+    # number of transform processes, 'auto' and '0' mean one process per CPU
+    if str(value).lower() in ('auto', '0'):
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def get_schemas(settings):
+    """ function that gets column names of source (Landing) and target (Staging) tables from Glue Catalog
+    :param settings: dictionary with configuration values
+    :return: tuple of source and target column name lists
+    """
+    g_client = bootstrap.client('glue')
+    old_cols = get_glue_schema(g_client, settings["account_id"], settings["source_db"], settings["source_table"],
+                               partitioned=False)
+    new_cols = get_glue_schema(g_client, settings["account_id"], settings["target_db"], settings["target_table"],
+                               partitioned=True)
+    return old_cols, new_cols
+
+
+def get_prefix(landing_path, day):
+    # landing zone object key prefix of the day, day is a string in '%Y-%m-%d' format
+    return landing_path + day.split("-")[0] + "/" + day.split("-")[1] + "/" + day.split("-")[2] + "/"
+
+
+def transform_shard(frame, new_cols):
+    """ function that carries out necessary transformations on the landing data: text cleaning, sentiment analysis,
+    hashtag explode, primary key generation with deduplication and partition columns. Wall time of every step and
+    sentiment cache hit rate are recorded in metrics when the shard is transformed in the handler process. It takes input
+    :param frame: Pandas dataframe loaded from Landing zone
+    :param new_cols: list of target (Staging) table column names
+    :return: Pandas dataframe with target table columns
+    """
+    if frame.shape[0] == 0:
+        # landing files of the window are all empty, split of an empty sentiment column has no columns
+        return pd.DataFrame(columns=new_cols)
     frame.set_index('record_id')
     frame['record_id'] = frame['record_id'].astype(str)
-    frame['time_stamp'] = frame.timestamp.apply(get_timestamp)
+    with metrics.timer("TimestampTime"):
+        frame['time_stamp'] = frame.timestamp.apply(get_timestamp)
     frame['tweet_id'] = frame['tweet_id'].astype(str)
-    frame['text_clean'] = frame.text.apply(clean_tweet)
-    frame['sentiment'] = frame.text_clean.apply(text_sentiment)
+    with metrics.timer("CleanTextTime"):
+        frame['text_clean'] = frame.text.apply(clean_tweet)
+    cache_before = text_sentiment.cache_info()
+    with metrics.timer("SentimentTime"):
+        frame['sentiment'] = frame.text_clean.apply(text_sentiment)
+    cache_after = text_sentiment.cache_info()
+    lookups = cache_after.hits + cache_after.misses - cache_before.hits - cache_before.misses
+    if lookups:
+        metrics.put("SentimentCacheHitRate", 100 * (cache_after.hits - cache_before.hits) / lookups, "Percent")
     _df_sent = frame.sentiment.str.split(" ", expand=True)
     frame['polarity'] = _df_sent[0]
     frame['subjectivity'] = _df_sent[1]
-    frame['clean_hashtags'] = frame.hashtags.apply(clean_hashtags)
-    frame['hashtag'] = frame.clean_hashtags.str.split(' ')
-    _df = frame.explode('hashtag')
-    _df.hashtag.replace('', np.nan, inplace=True)
-    _df.dropna(subset=['hashtag'], inplace=True)
+    with metrics.timer("HashtagTime"):
+        frame['clean_hashtags'] = frame.hashtags.apply(clean_hashtags)
+        frame['hashtag'] = frame.clean_hashtags.str.split(' ')
+        _df = frame.explode('hashtag')
+        _df.hashtag.replace('', np.nan, inplace=True)
+        _df.dropna(subset=['hashtag'], inplace=True)
     _df['hash_string'] = _df['record_id'] + _df['tweet_id'] + _df['hashtag']
     # generate PK column and remove duplicates
-    _df['hash_id'] = _df \
-        .hash_string.astype(str).str.encode('UTF-8') \
-        .apply(generate_hash_key).str.decode("utf-8")
-    _df = _df.drop_duplicates(subset=['hash_id'])
+    with metrics.timer("HashKeyTime"):
+        _df['hash_id'] = _df \
+            .hash_string.astype(str).str.encode('UTF-8') \
+            .apply(generate_hash_key).str.decode("utf-8")
+        _df = _df.drop_duplicates(subset=['hash_id'])
     # generate partition columns
-    _df['year'] = _df.timestamp.apply(get_year)
-    _df['month'] = _df.timestamp.apply(get_month)
-    _df['day'] = _df.timestamp.apply(get_day)
+    with metrics.timer("PartitionColsTime"):
+        _df['year'] = _df.timestamp.apply(get_year)
+        _df['month'] = _df.timestamp.apply(get_month)
+        _df['day'] = _df.timestamp.apply(get_day)
+
+    return _df[new_cols].copy()
+
+
+def serialize_frame(df):
+    """ function that serializes dataframe to be sent from a worker process, Arrow IPC stream is used if pyarrow
+    is available, it is faster to write and read than pickled dataframe
+    :param df: Pandas dataframe
+    :return: tuple of format name and bytes
+    """
+    if pyarrow is not None:
+        sink = pyarrow.BufferOutputStream()
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        with pa_ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return "arrow", sink.getvalue().to_pybytes()
+    return "pickle", pickle.dumps(df.reset_index(drop=True), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def deserialize_frame(fmt, payload):
+    # inverse of serialize_frame
+    if fmt == "arrow":
+        return pa_ipc.open_stream(payload).read_all().to_pandas()
+    return pickle.loads(payload)
+
+
+# dataframe shared with forked worker processes, workers read their shard from memory inherited from the parent process
+_shared_frame = None
 
-    df = _df[new_cols].copy()
-    full_name = staging_path + staging_file + '_' + record_time + '.csv'
-    save_df_to_s3(df, s3, bucket_name, full_name)
+
+def _transform_worker(conn, start, stop, new_cols):
+    # runs in a forked process, only the transformed shard is sent back through the pipe
+    try:
+        conn.send(("ok",) + serialize_frame(transform_shard(_shared_frame.iloc[start:stop].copy(), new_cols)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}", None))
+    finally:
+        conn.close()
+
+
+def transform_frame(frame, new_cols, workers=1):
+    """ function that transforms landing data in a number of worker processes. Frame is split into contiguous shards,
+    each worker transforms one shard, then shards are concatenated in their original order and deduplicated again,
+    so the result is the same as transform_shard of the whole frame. Workers are forked processes connected with pipes,
+    since process pools and shared memory are not available in Lambda environment. It takes input
+    :param frame: Pandas dataframe loaded from Landing zone
+    :param new_cols: list of target (Staging) table column names
+    :param workers: number of worker processes
+    :return: Pandas dataframe with target table columns
+    """
+    global _shared_frame
+    workers = min(workers, frame.shape[0])
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return transform_shard(frame, new_cols)
+
+    ctx = multiprocessing.get_context('fork')
+    bounds = [frame.shape[0] * i // workers for i in range(workers + 1)]
+    _shared_frame = frame
+    jobs = []
+    try:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_transform_worker, args=(child_conn, start, stop, new_cols))
+            proc.start()
+            child_conn.close()
+            jobs.append((proc, parent_conn))
+        shards = []
+        for proc, conn in jobs:
+            status, fmt, payload = conn.recv()
+            proc.join()
+            if status != "ok":
+                raise RuntimeError(f"Transform worker failed: {fmt}")
+            shards.append(deserialize_frame(fmt, payload))
+    finally:
+        _shared_frame = None
+        for proc, conn in jobs:
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+    df = pd.concat(shards, axis=0, ignore_index=True)
+    return df.drop_duplicates(subset=['hash_id'])[new_cols]
+
+
+def process_partition(settings, files, old_cols, new_cols, full_name, day, run_id=None):
+    """ function that loads landing files, transforms them and saves the result to Staging zone. Output objects are
+    fully overwritten, so processing the same files again gives the same result. It takes input
+    :param settings: dictionary with configuration values
+    :param files: list of landing zone object keys
+    :param old_cols: list of source (Landing) table column names
+    :param new_cols: list of target (Staging) table column names
+    :param full_name: target staging object key
+    :param day: staging partition day in '%Y-%m-%d' format
+    :param run_id: id of an incremental run, its rollups are added to the rollups of the day. If not provided the files
+    are all landing files of the day and rollups of the day are replaced
+    :return: number of rows saved
+    """
+    if not files:
+        print("No landing files to process")
+        return 0
+    s3 = bootstrap.resource('s3')
+    bucket_name = settings["bucket_name"]
+    with metrics.timer("LoadTime"):
+        frame = load_from_s3(bootstrap.client("s3"), bucket_name, files, old_cols)
+    metrics.add("RecordsIn", frame.shape[0])
+    with metrics.timer("TransformTime"):
+        df = transform_frame(frame, new_cols, settings["transform_workers"])
+    with metrics.timer("SaveTime"):
+        save_df_to_s3(df, s3, bucket_name, full_name)
     count_row = df.shape[0]
-    log_record = f"'{record_time}', '{target_db}.{target_table}', {count_row}, {get_year(record_time)}, {get_month(record_time)}, {get_day(record_time)}"
+    metrics.add("RecordsOut", count_row)
+    if settings["rollup_path"] and count_row > 0:
+        process_rollups(settings, df, s3, day, run_id)
+    return count_row
+
+
+def process_rollups(settings, df, s3, day, run_id=None):
+    """ function that computes ingest time top hashtag rollups of the transformed data and saves them, dashboards
+    read them instead of scanning hashtag_data table. Incremental runs load only landing files of their time window,
+    so their rollups are saved under the run id and rollups of earlier runs of the day are kept. Reprocessing of a
+    whole day removes all rollups of the day before saving its own. It takes input
+    :param settings: dictionary with configuration values
+    :param df: Pandas dataframe with target table columns
+    :param s3: S3 resource client
+    :param day: staging partition day in '%Y-%m-%d' format
+    :param run_id: id of an incremental run in '%Y-%m-%d_%H%M%S' format, None when the whole day is reprocessed
+    :return: None
+    """
+    with metrics.timer("RollupTime"):
+        rollups = hashtag_sketch.build_rollups(
+            zip(df.time_stamp, df.hashtag, df.polarity, df.subjectivity),
+            settings["rollup_bucket_minutes"], settings["rollup_top_k"], settings["rollup_eps"])
+        if run_id is None:
+            client = bootstrap.client("s3")
+            # run ids start with the day, so objects of the day and of its runs share the prefix
+            stale = [k for path in (settings["rollup_path"], settings["rollup_snapshot_path"])
+                     for k in list_s3_objs(client, settings["bucket_name"], path + 'hashtag_rollup_' + day)]
+            delete_s3_objs(client, settings["bucket_name"], stale)
+        rollup_rows = save_rollups(rollups, s3, settings["bucket_name"], settings["rollup_path"],
+                                   settings["rollup_snapshot_path"], run_id or day)
+    print(f"{rollup_rows} hashtag rollup rows saved for {len(rollups)} time buckets")
+
+
+def get_log_record(settings, record_time, count_row):
+    # indicators of data processing to be used by update-data-log Lambda
+    return f"'{record_time}', '{settings['target_db']}.{settings['target_table']}', {count_row}, {get_year(record_time)}, {get_month(record_time)}, {get_day(record_time)}"
+
+
+@boto_safe_run
+def list_s3_objs(client, bucket, prefix):
+    """ function that lists all object keys under the prefix
+    :param client: S3 client
+    :param bucket: S3 bucket
+    :param prefix: prefix of the file objects keys
+    :return: list of S3 file object keys
+    """
+    keys = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys += [ob["Key"] for ob in page.get("Contents", [])]
+    return keys
+
+
+@boto_safe_run
+def get_finished_days(client, settings):
+    """ function that reads backfill progress log, one marker object per finished day
+    :param client: S3 client
+    :param settings: dictionary with configuration values
+    :return: set of finished days
+    """
+    keys = list_s3_objs(client, settings["bucket_name"], settings["backfill_log_path"])
+    return {k[len(settings["backfill_log_path"]):-len('.json')] for k in keys if k.endswith('.json')}
+
+
+def process_day(settings, day, old_cols=None, new_cols=None):
+    """ function that processes all landing files of a single day and records it in backfill progress log. It takes input
+    :param settings: dictionary with configuration values
+    :param day: string in '%Y-%m-%d' format
+    :param old_cols: list of source (Landing) table column names, read from Glue Catalog if not provided
+    :param new_cols: list of target (Staging) table column names, read from Glue Catalog if not provided
+    :return: log record string for update-data-log Lambda
+    """
+    if old_cols is None or new_cols is None:
+        old_cols, new_cols = get_schemas(settings)
+    files = list_s3_objs(bootstrap.client("s3"), settings["bucket_name"], get_prefix(settings["landing_path"], day))
+    full_name = settings["staging_path"] + settings["staging_file"] + '_' + day + '.csv'
+    count_row = process_partition(settings, files, old_cols, new_cols, full_name, day)
+    marker = {"day": day, "files": len(files), "rows": count_row,
+              "finished": datetime.now(tz=pytz.utc).strftime('%Y-%m-%d %H:%M:%S')}
+    bootstrap.resource('s3').Object(settings["bucket_name"], settings["backfill_log_path"] + day + '.json') \
+        .put(Body=json.dumps(marker))
+    print(f"{day}: {count_row} rows from {len(files)} landing files")
+    return get_log_record(settings, day, count_row)
+
+
+def _init_worker():
+    # clients inherited from the parent process must not be shared with forked workers
+    bootstrap.reset()
+
+
+def _process_day_worker(args):
+    return process_day(*args)
+
+
+def get_days(start_date, end_date):
+    # list of days in '%Y-%m-%d' format between start and end date inclusive
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+
+def plan_slices(files, workers):
+    # contiguous slices of landing files of similar length, one slice per worker
+    count = min(workers, len(files))
+    bounds = [len(files) * i // count for i in range(count + 1)] if count else [0]
+    return [files[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def get_fanout_prefix(settings, run_id):
+    # S3 prefix of the plan and partial outputs of a fan-out run
+    return settings["fanout_path"] + run_id + "/"
+
+
+@boto_safe_run
+def load_plan(client, settings, run_id):
+    """ function that loads fan-out plan saved by plan_fanout
+    :param client: S3 client
+    :param settings: dictionary with configuration values
+    :param run_id: id of the fan-out run
+    :return: dictionary with run id, record time and list of slices of landing file keys
+    """
+    body = client.get_object(Bucket=settings["bucket_name"],
+                             Key=get_fanout_prefix(settings, run_id) + "plan.json")["Body"].read()
+    return json.loads(body)
+
+
+def plan_fanout(settings, workers=None):
+    """ function that lists new landing files of the current day, splits them into slices and saves the plan to S3,
+    so that Map state items only carry run id and slice number. It takes input
+    :param settings: dictionary with configuration values
+    :param workers: number of slices, FANOUT_WORKERS if not provided
+    :return: dictionary with run id and list of worker event items
+    """
+    timezone = pytz.timezone(settings["time_zone"])
+    now = datetime.now(tz=timezone)
+    record_time = now.strftime("%Y-%m-%d")
+    run_id = now.strftime("%Y-%m-%d_%H%M%S")
+    files = filter_s3_objs(bootstrap.client("s3"), settings["bucket_name"],
+                           get_prefix(settings["landing_path"], record_time), timezone, settings["time_horizon"])
+    slices = plan_slices(files, int(workers or settings["fanout_workers"]))
+    plan = {"run_id": run_id, "record_time": record_time, "slices": slices}
+    bootstrap.client("s3").put_object(Bucket=settings["bucket_name"],
+                                      Key=get_fanout_prefix(settings, run_id) + "plan.json", Body=json.dumps(plan))
+    print(f"{len(files)} landing files planned in {len(slices)} slices, run {run_id}")
+    return {"run_id": run_id, "slices": [{"action": "work", "run_id": run_id, "slice": i} for i in range(len(slices))]}
+
+
+def process_slice(settings, run_id, index):
+    """ function that transforms landing files of a single slice of the plan and saves them as partial output.
+    Rollups are not computed by workers, they are computed from merged data. It takes input
+    :param settings: dictionary with configuration values
+    :param run_id: id of the fan-out run
+    :param index: slice number
+    :return: dictionary with slice number and number of rows saved
+    """
+    plan = load_plan(bootstrap.client("s3"), settings, run_id)
+    old_cols, new_cols = get_schemas(settings)
+    part_name = get_fanout_prefix(settings, run_id) + f"part_{index:04d}.csv"
+    count_row = process_partition(dict(settings, rollup_path=None), plan["slices"][index], old_cols, new_cols,
+                                  part_name, plan["record_time"])
+    print(f"slice {index}: {count_row} rows from {len(plan['slices'][index])} landing files")
+    return {"slice": index, "rows": count_row}
+
+
+@boto_safe_run
+def delete_s3_objs(client, bucket, keys):
+    # deletes objects in requests of up to 1000 keys, the limit of delete_objects
+    for i in range(0, len(keys), 1000):
+        client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]]})
+
+
+def merge_slices(settings, run_id):
+    """ function that combines partial outputs of all slices, removes rows with duplicate hash_id across slices, eg.
+    records delivered twice by Kinesis and saved in different landing files, saves the result to Staging zone, computes
+    hashtag rollups and removes plan and partial outputs. Partial outputs are read as strings, so values are saved
+    unchanged. It takes input
+    :param settings: dictionary with configuration values
+    :param run_id: id of the fan-out run
+    :return: log record string for update-data-log Lambda
+    """
+    client = bootstrap.client("s3")
+    bucket_name = settings["bucket_name"]
+    plan = load_plan(client, settings, run_id)
+    run_keys = list_s3_objs(client, bucket_name, get_fanout_prefix(settings, run_id))
+    parts = sorted(k for k in run_keys if k.endswith('.csv'))
+    if len(parts) < len(plan["slices"]):
+        raise RuntimeError(f"Fan-out run {run_id} has {len(parts)} partial outputs of {len(plan['slices'])} slices")
+    count_row = 0
+    if parts:
+        _, new_cols = get_schemas(settings)
+        with metrics.timer("LoadTime"):
+            df = load_from_s3(client, bucket_name, parts, new_cols, dtype=str)
+        df = df.drop_duplicates(subset=['hash_id'])
+        full_name = settings["staging_path"] + settings["staging_file"] + '_' + plan["record_time"] + '.csv'
+        s3 = bootstrap.resource('s3')
+        with metrics.timer("SaveTime"):
+            save_df_to_s3(df, s3, bucket_name, full_name)
+        count_row = df.shape[0]
+        if settings["rollup_path"] and count_row > 0:
+            process_rollups(settings, df, s3, plan["record_time"], run_id)
+        print(f"{count_row} rows merged from {len(parts)} partial outputs")
+    else:
+        print("No landing files to process")
+    delete_s3_objs(client, bucket_name, run_keys)
+    return get_log_record(settings, plan["record_time"], count_row)
+
+
+@profiling.profiled
+@metrics.handler
+def backfill_handler(event, context):
+    """ Backfill and reprocessing entry point. Event keys select the mode:
+        "day" - processes all landing files of a single day, used by the Map state of StagingBackfillStateMachine
+        "start_date", "end_date" - splits the date range into days, skips days found in the progress log unless
+        "resume" is false, then returns pending days if "plan_only" is true (Map state input), otherwise processes
+        them in a local process pool of "workers" processes. Process pools are not available in Lambda environment,
+        there and with a single worker the days are processed one after another in this process
+    """
+    settings = load_settings()
+    if "day" in event:
+        return {"day": event["day"], "values": process_day(settings, event["day"])}
+
+    days = get_days(event["start_date"], event["end_date"])
+    if event.get("resume", True):
+        finished = get_finished_days(bootstrap.client("s3"), settings)
+        skipped = [d for d in days if d in finished]
+        days = [d for d in days if d not in finished]
+    else:
+        skipped = []
+    if event.get("plan_only"):
+        return {"days": [{"day": d} for d in days], "skipped": skipped}
+
+    old_cols, new_cols = get_schemas(settings)
+    workers = max(1, min(int(event.get("workers", os.cpu_count() or 1)), len(days) or 1))
+    if workers <= 1 or 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+        values = [process_day(settings, d, old_cols, new_cols) for d in days]
+    else:
+        # days are already processed in parallel, transform of each day runs in its worker process
+        settings["transform_workers"] = 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            values = list(executor.map(_process_day_worker, [(settings, d, old_cols, new_cols) for d in days]))
+    return {"processed": [{"day": d, "values": v} for d, v in zip(days, values)], "skipped": skipped}
+
+
+@profiling.profiled
+@metrics.handler
+def lambda_handler(event, context):
+    settings = load_settings()
+    timezone = pytz.timezone(settings["time_zone"])
+
+    now = datetime.now(tz=timezone)
+    record_time = now.strftime("%Y-%m-%d")
+    run_id = now.strftime("%Y-%m-%d_%H%M%S")
+    prefix_string = get_prefix(settings["landing_path"], record_time)
+    # get column names from Glue Catalog
+    old_cols, new_cols = get_schemas(settings)
+    # get filtered file list from S3 and process its files
+    files = filter_s3_objs(bootstrap.client("s3"), settings["bucket_name"], prefix_string, timezone,
+                           settings["time_horizon"])
+    full_name = settings["staging_path"] + settings["staging_file"] + '_' + record_time + '.csv'
+    count_row = process_partition(settings, files, old_cols, new_cols, full_name, record_time, run_id)
     # return indicators of data processing to be used by update-data-log Lambda.
-    return log_record
+    return get_log_record(settings, record_time, count_row)
+
+
+@profiling.profiled
+@metrics.handler
+def fanout_handler(event, context):
+    """ Distributed staging entry point for days with more landing data than a single invocation can process.
+    Event 'action' key selects the step:
+        "plan" (default) - splits new landing files of the current day into "workers" slices (FANOUT_WORKERS if not
+        provided) and returns worker items for the Map state of LandingAnalyticalStateMachine
+        "work" - transforms landing files of "slice" of fan-out run "run_id" into partial output
+        "merge" - combines partial outputs of "run_id" into Staging object, returns log record for update-data-log
+        "local" - runs all steps in this process, workers one after another, eg. in local runs and benchmarks
+    """
+    settings = load_settings()
+    action = event.get("action", "plan")
+    if action == "plan":
+        return plan_fanout(settings, event.get("workers"))
+    if action == "work":
+        return process_slice(settings, event["run_id"], int(event["slice"]))
+    if action == "merge":
+        return merge_slices(settings, event["run_id"])
+    if action == "local":
+        fanout = plan_fanout(settings, event.get("workers"))
+        for item in fanout["slices"]:
+            process_slice(settings, item["run_id"], item["slice"])
+        return merge_slices(settings, fanout["run_id"])
+    raise ValueError(f"Unknown fan-out action: {action}")
+
+
+if __name__ == '__main__':
+    # local backfill run, eg. python staging-transform.py 2020-09-01 2020-09-07 --workers 4
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="staging transform backfill")
+    arg_parser.add_argument('start_date')
+    arg_parser.add_argument('end_date')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--no-resume', action='store_true', help="reprocess days found in the progress log")
+    args = arg_parser.parse_args()
+    print(json.dumps(backfill_handler({"start_date": args.start_date, "end_date": args.end_date,
+                                       "workers": args.workers, "resume": not args.no_resume}, None), indent=2))
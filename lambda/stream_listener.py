@@ -3,18 +3,23 @@ import time
 import tweepy
 import json
 from botocore.exceptions import ClientError, ParamValidationError
+import instrumentation
+import kinesis_utils
 
 class MyStreamListener(tweepy.StreamListener):
     """
     Class MyStreamListener extends StreamListener parent class provided by Tweepy library. It is used to handle
     data stream from Twitter streaming API and put filtered records into Kinesis Data Stream shard.
     """
-    def __init__(self, api, time_limit, kinesis_client, stream_name):
+    def __init__(self, api, time_limit, kinesis_client, stream_name, max_shards=1, throttle_limit=10, max_retries=5):
         """ Class constructor, defines class parameters
         :param api: Twitter API authorised connection object
         :param time_limit: time to run in seconds
-        :param kinesis_client: Kinesis service client
+        :param kinesis_client: Kinesis service client without boto3 retries, so every throttled write is counted
         :param stream_name: name of Kinesis stream
+        :param max_shards: max number of shards the stream can be resharded to when writes are throttled
+        :param throttle_limit: number of throttled writes after which the stream is resharded
+        :param max_retries: max number of attempts to put a throttled record
         """
         self.api = api
         self.me = api.me()
@@ -22,8 +27,45 @@ class MyStreamListener(tweepy.StreamListener):
         self.limit = time_limit
         self.kinesis_client = kinesis_client
         self.stream_name = stream_name
+        self.max_shards = max_shards
+        self.throttle_limit = throttle_limit
+        self.max_retries = max_retries
+        self.throttled = 0
         super().__init__()
 
+    def on_throttle(self):
+        """ Function that counts throttled writes and doubles number of shards of the stream, up to max_shards,
+        once throttle_limit has been reached. Counter is reset when resharding has been started.
+        :return: None
+        """
+        self.throttled += 1
+        instrumentation.add("ThrottledWrites", 1)
+        if self.throttled < self.throttle_limit:
+            return
+        summary = self.kinesis_client.describe_stream_summary(StreamName=self.stream_name)['StreamDescriptionSummary']
+        shards = summary['OpenShardCount']
+        if summary['StreamStatus'] == 'ACTIVE' and shards < self.max_shards:
+            if kinesis_utils.reshard(self.kinesis_client, self.stream_name, min(shards * 2, self.max_shards)):
+                self.throttled = 0
+
+    def put_record(self, record_encoded, partition_key):
+        """ Function that puts record into Kinesis stream. Throttled writes are retried with exponential backoff.
+        :param record_encoded: record data bytes
+        :param partition_key: partition key of the record
+        :return: put_record response
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return self.kinesis_client.put_record(Data=record_encoded,
+                                                      StreamName=self.stream_name,
+                                                      PartitionKey=partition_key)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ProvisionedThroughputExceededException' \
+                        or attempt == self.max_retries - 1:
+                    raise e
+                self.on_throttle()
+                time.sleep(min(0.1 * 2 ** attempt, 2))
+
     def on_status(self, status):
         """ Override of the StreamListener native function that receives tweet data from on_data - another native function
          of this class. Function performs multi step filtering of the tweet stream. It takes value of tweet record
@@ -36,6 +78,7 @@ class MyStreamListener(tweepy.StreamListener):
         """
 
         if (time.time() - self.start_time) < self.limit:
+            instrumentation.add("RecordsIn", 1)
             record = []
             tweet_txt = ""
             # filter tweet records
@@ -72,9 +115,10 @@ class MyStreamListener(tweepy.StreamListener):
                     record_encoded = bytes(str(_record), 'utf-8')
 
                     try:
-                        response = self.kinesis_client.put_record(Data=record_encoded,
-                                                                  StreamName=self.stream_name,
-                                                                  PartitionKey='111')
+                        # tweet id is used as partition key to spread records across shards
+                        response = self.put_record(record_encoded, tweet_id)
+                        instrumentation.add("RecordsOut", 1)
+                        instrumentation.add("BytesWritten", len(record_encoded), "Bytes")
                     # boto3 error handling using ClientError and ParamValidationError errors.
                     except ClientError as e:
                         print("Kinesis stream returned error: ", e.response['Error']['Message'])
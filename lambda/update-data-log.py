@@ -4,21 +4,27 @@ Function also return indicators of data processing to be used by update-data-log
 :param TARGET_TABLE, the name of target (Analytical) table in Glue Catalog
 :param ATHENA_OUT, output directory path, required parameter for Athena query execution
 """
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-import os
+import bootstrap
+import config_provider
+import instrumentation
+import profiling
 
-database = os.environ['OPERATIONAL_DB']
-output = os.environ['ATHENA_OUT']
-target_table = os.environ['TARGET_TABLE']
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('update-data-log')
 
 
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
+    database = config['OPERATIONAL_DB']
+    output = config['ATHENA_OUT']
+    target_table = config['TARGET_TABLE']
     # parse event object supplied by Step Functions trigger into Athen query
     insert_values = event["values"]
     query = f'INSERT INTO {target_table} VALUES ({insert_values})'
     
-    client = boto3.client('athena')
+    client = bootstrap.client('athena')
 
     try:
         # insert record of data processing indicators into operational.data_update_log table
@@ -39,6 +45,9 @@ def lambda_handler(event, context):
             status = response_2['QueryExecution']['Status']['State']
 
         print('Query result: ', status)
+        metrics.add("AthenaBytesScanned",
+                    response_2['QueryExecution'].get('Statistics', {}).get('DataScannedInBytes', 0), "Bytes")
+        metrics.add("RecordsOut", 1 if status == 'SUCCEEDED' else 0)
         if status != 'SUCCEEDED':
             # handle query execution errors
             print('Error: ', response_2['QueryExecution']['Status']['StateChangeReason'])
@@ -1,27 +1,41 @@
 """ Lambda function that handles updating of environmental variables of all other Lambda functions in the project.
 Environmental variable data is stored on DynamoDB. When it is updated this Lambda is triggered by DynamoDB Streams.
-DynamoDB Stream provides keys for updated Lambda functions.  This Lambda parses stream data, generates a list of updatable
-Lambda functions, then retrieves their environmental variable data from DynamoDB and performs updates
-in respective Lambda functions. It requires environmental variables
+DynamoDB Stream provides keys for updated Lambda functions.  This Lambda parses stream data, generates a deduplicated list
+of updatable Lambda functions, then retrieves their environmental variable data from DynamoDB in batches and performs
+updates in respective Lambda functions using a bounded pool of worker threads. It requires environmental variables
 :param MY_AWS_REGION, AWS region where DynamoDB database has been created.
 :param DDB_TABLE, the name of DynamoDB table.
 :param DDB_KEY, the name of defined primary key in DynamoDB table.
+:param MAX_WORKERS, optional, max number of Lambda functions updated concurrently, default 4
+:param MAX_RETRIES, optional, max number of update attempts when Lambda function is being updated and of DynamoDB batch
+requests of unprocessed keys, default 5
 """
 import json
-import boto3
-from botocore.exceptions import ClientError, ParamValidationError
+from botocore.exceptions import ClientError, ParamValidationError, WaiterError
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
+import bootstrap
+import instrumentation
+import profiling
 
 
 aws_region = os.environ['MY_AWS_REGION']
 table_name = os.environ['DDB_TABLE']
 key = os.environ['DDB_KEY']
+max_workers = int(os.environ.get('MAX_WORKERS', '4'))
+max_retries = int(os.environ.get('MAX_RETRIES', '5'))
 
-dynamodb_client = boto3.client('dynamodb', region_name=aws_region)
-dynamodb_resource = boto3.resource('dynamodb', region_name=aws_region)
-client = boto3.client('lambda')
+dynamodb_resource = bootstrap.resource('dynamodb', aws_region)
+client = bootstrap.client('lambda')
 
+# max number of keys DynamoDB accepts in a single batch_get_item request
+BATCH_SIZE = 100
+metrics = instrumentation.Metrics('update-lambda-from-ddb')
 
+
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
 
     def boto_safe_run(func):
@@ -32,7 +46,7 @@ def lambda_handler(event, context):
         def inner_function(*args, **kwargs):
             # inner function that uses arguments of the outer function runs it applying error handling functionality
             try:
-                return func(*args, *kwargs)
+                return func(*args, **kwargs)
             except ClientError as e:
                 print("AWS client returned error: ", e.response['Error']['Message'])
                 raise e
@@ -40,63 +54,113 @@ def lambda_handler(event, context):
                 raise ValueError(f'The parameters you provided are incorrect: {e}')
         return inner_function
 
+    def parse_variables(item):
+        """ function that parses environmental variable data located under 'Variables' key of DynamoDB item
+        :param item: DynamoDB item
+        :return: json object with environmental variable data
+        """
+        env = item['Variables'].replace("'", "\"")
+        return json.loads(env)
+
     @boto_safe_run
-    def get_ddb_item(tbl_name, region, key_name, item_name, ddb_r=None):
-        """ function that loads loads item data from DynamoDB. Environmental variable data is located under
-         'Variables' key, therefore it is used to retrieve the relevant data. It requires input
+    def get_ddb_items(tbl_name, key_name, item_names, ddb_r):
+        """ function that loads item data from DynamoDB using batch_get_item calls, BATCH_SIZE keys per call.
+        Unprocessed keys returned by DynamoDB are requested again, up to max_retries attempts per batch.
+        It requires input
         :param tbl_name: the name of DynamoDB table
-        :param region: the name of AWS region where DynomoDB table is located
         :param key_name: the name of primary key in DynamoDB table
-        :param item_name: name of the item to retrieve the data
+        :param item_names: list of item names to retrieve the data
         :param ddb_r: DynamoDB resource client name
-        :return: json object with environmental variable data
+        :return: dictionary of item name and json object with environmental variable data, list of item names that
+        remained unprocessed
         """
-        if not ddb_r:
-            ddb_r = boto3.resource('dynamodb', region_name=region)
-        # instantiate table object
-        table = ddb_r.Table(tbl_name)
-        # get item data from DynamoDB and parse data under 'Variables' key into json object
-        response = table.get_item(Key={key_name: item_name})
-        env = response['Item']['Variables'].replace("'", "\"")
-        env_dict = json.loads(env)
-        return env_dict
+        settings = {}
+        unprocessed = []
+        for i in range(0, len(item_names), BATCH_SIZE):
+            request = {tbl_name: {'Keys': [{key_name: name} for name in item_names[i:i + BATCH_SIZE]]}}
+            for attempt in range(1, max(1, max_retries) + 1):
+                response = ddb_r.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(tbl_name, []):
+                    settings[item[key_name]] = parse_variables(item)
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                if attempt < max_retries:
+                    # back off before requesting throttled keys again
+                    time.sleep(min(0.1 * 2 ** attempt, 5))
+            if request:
+                unprocessed += [k[key_name] for k in request[tbl_name]['Keys']]
+        return settings, unprocessed
 
-    @boto_safe_run
-    def update_lambda(name, params, l_client=None):
-        """ function that updates environmental variables for Lambda function by function name. It tkaes input
-        :param name: name of the LAmbda function to be updated
+    def update_lambda(name, params, l_client):
+        """ function that updates environmental variables for Lambda function by function name. Update is retried with
+        exponential backoff while the function is being updated by another request (ResourceConflictException), then
+        it waits until the function reaches function_updated state. It takes input
+        :param name: name of the Lambda function to be updated
         :param params: json object containing environmental variable data
         :param l_client: Lambda service client
-        :return: string with information about the performed update
+        :return: dictionary with function name, update outcome, number of attempts and duration in seconds
         """
-        if not l_client:
-            l_client = boto3.client('lambda')
-        # perform update
-        result = l_client.update_function_configuration(
-            FunctionName=name,
-            Environment={"Variables": params})
-        # handle update response
-        response = f"Updated lambda {name}, environmental variables: ", json.dumps(result['Environment'])
-        print(f"Updated lambda {name}, environmental variables: ", json.dumps(result['Environment']))
-        if 'Error' in result['Environment']:
-            response = "Update error: " + result['Environment']['Error']['Message']
-    
-        return response
+        start = time.monotonic()
+        outcome = {"function": name, "status": "UPDATED", "attempts": 0}
+        try:
+            while True:
+                outcome["attempts"] += 1
+                try:
+                    result = l_client.update_function_configuration(
+                        FunctionName=name,
+                        Environment={"Variables": params})
+                    break
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ResourceConflictException' or outcome["attempts"] >= max_retries:
+                        raise e
+                    print(f"Lambda {name} is being updated, retrying")
+                    time.sleep(min(2 ** outcome["attempts"], 30))
+
+            if 'Error' in result['Environment']:
+                outcome["status"] = "FAILED"
+                outcome["error"] = result['Environment']['Error']['Message']
+            else:
+                # wait for the update to be applied so that subsequent updates of the same function do not conflict
+                l_client.get_waiter('function_updated').wait(FunctionName=name)
+        except ClientError as e:
+            print(f"Lambda {name} update returned error: ", e.response['Error']['Message'])
+            outcome["status"] = "FAILED"
+            outcome["error"] = e.response['Error']['Message']
+        except WaiterError as e:
+            print(f"Lambda {name} update did not complete: ", e)
+            outcome["status"] = "FAILED"
+            outcome["error"] = str(e)
+        except ParamValidationError as e:
+            outcome["status"] = "FAILED"
+            outcome["error"] = f'The parameters you provided are incorrect: {e}'
+        outcome["duration_seconds"] = round(time.monotonic() - start, 3)
+        metrics.observe("UpdateTime", outcome["duration_seconds"] * 1000)
+        print(json.dumps(outcome))
+        return outcome
 
     lambda_list = []
 
-    # iterate over DynamoDB Stream data and store Lambda function names that have been updated into list
+    # iterate over DynamoDB Stream data and store unique Lambda function names that have been updated into list
     for record in event['Records']:
         print("Event type: ", record['eventName'])
-        lambda_key = record["dynamodb"]["Keys"]["Lambda"]["S"]
-        lambda_list.append(lambda_key)
-
-    # iterate over list of Lambda function names and perform updates
-    for lambda_id in lambda_list:
-        print(lambda_id)
-        
-        settings = get_ddb_item(table_name, aws_region,  key, lambda_id, dynamodb_resource)
-        update = update_lambda(lambda_id, settings, client)
-        print(update)
-    
-    return json.dumps({"exit_status":"SUCCESS"})
+        lambda_key = record["dynamodb"]["Keys"][key]["S"]
+        if lambda_key not in lambda_list:
+            lambda_list.append(lambda_key)
+
+    settings, unprocessed = get_ddb_items(table_name, key, lambda_list, dynamodb_resource)
+    results = [{"function": name, "status": "FAILED", "attempts": 0, "duration_seconds": 0.0,
+                "error": "DynamoDB item was not processed"} for name in unprocessed]
+    results += [{"function": name, "status": "NOT_FOUND", "attempts": 0, "duration_seconds": 0.0}
+                for name in lambda_list if name not in settings and name not in unprocessed]
+
+    # perform updates of Lambda functions concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(settings) or 1))) as executor:
+        futures = [executor.submit(update_lambda, name, settings[name], client)
+                   for name in lambda_list if name in settings]
+        results += [f.result() for f in futures]
+
+    metrics.add("RecordsIn", len(event['Records']))
+    metrics.add("RecordsOut", sum(1 for r in results if r["status"] == "UPDATED"))
+    status = "SUCCESS" if all(r["status"] != "FAILED" for r in results) else "FAILED"
+    return json.dumps({"exit_status": status, "updates": results})
@@ -1,56 +1,158 @@
 
-""" Lambda function that initialises AWS Quicksight dataset ingestion for analytical.hashtag_data dataset
-zone. It requires environmental variables
+""" Lambda function that initialises AWS Quicksight dataset ingestion for analytical.hashtag_data dataset and checks its
+status. Function does not wait for ingestion to complete, waiting is done by Step Functions Wait state between status checks.
+Event 'action' key selects the operation:
+    "start" (default) - starts ingestion and returns its id
+    "status" - returns status of the ingestion with provided 'ingestion_id', emits ingestion metrics when it has completed.
+    Returned 'checks' counts the status checks of the ingestion, Step Functions fails the run when it reaches the limit
+In incremental mode only the data loaded since the last completed ingestion is ingested, using dataset lookback window
+on LOOKBACK_COLUMN. Full refresh is used when there is no previous ingestion. It requires environmental variables
 :param ACCOUNT_ID, user account id.
 :param QS_DATASET_ID, id of the Quicksight dataset
 :param TIME_ZONE, UTC timezone abbreviation to be used as home timezone, eg. 'Europe/Helsinki'
+:param REFRESH_MODE, optional, 'INCREMENTAL' or 'FULL', default 'INCREMENTAL'
+:param LOOKBACK_COLUMN, optional, dataset date column used for incremental refresh, default 'time_stamp'
+:param METRICS_NAMESPACE, optional, CloudWatch namespace of ingestion metrics, default 'TwitterETL'
 """
-import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-import json
-import os
+import math
 from datetime import datetime
 import pytz
-import time
+import bootstrap
+import config_provider
+import instrumentation
+import profiling
 
+config = config_provider.ConfigProvider()
+metrics = instrumentation.Metrics('update-quicksight-dataset')
 
-account_id = os.environ['ACCOUNT_ID']
-dataset_id = os.environ['QS_DATASET_ID']
-timezone = pytz.timezone(os.environ['TIME_ZONE'])
 
+@profiling.profiled
+@metrics.handler
 def lambda_handler(event, context):
+    account_id = config['ACCOUNT_ID']
+    dataset_id = config['QS_DATASET_ID']
+    timezone = pytz.timezone(config['TIME_ZONE'])
+    refresh_mode = config.get('REFRESH_MODE', 'INCREMENTAL').upper()
+    lookback_column = config.get('LOOKBACK_COLUMN', 'time_stamp')
+    metrics.namespace = config.get('METRICS_NAMESPACE', 'TwitterETL')
+
+    def boto_safe_run(func):
+        """ decorator (higher order function) to handle errors using boto3 using ClientError and ParamValidationError error types
+        :param func: outer function to be passed to decorator
+        :return: executed inner function
+        """
+        def inner_function(*args, **kwargs):
+            # inner function that uses arguments of the outer function runs it applying error handling functionality
+            try:
+                return func(*args, **kwargs)
+            except ClientError as e:
+                print("Quicksight client returned error: ", e.response['Error']['Message'])
+                raise e
+            except ParamValidationError as e:
+                raise ValueError(f'The parameters you provided are incorrect: {e}')
+        return inner_function
+
+    @boto_safe_run
+    def get_last_ingestion_time(client):
+        """ function that finds creation time of the last completed ingestion of the dataset
+        :param client: Quicksight service client
+        :return: datetime of the last completed ingestion, None if there is no such ingestion
+        """
+        last = None
+        paginator = client.get_paginator('list_ingestions')
+        for page in paginator.paginate(DataSetId=dataset_id, AwsAccountId=account_id):
+            for ingestion in page['Ingestions']:
+                if ingestion['IngestionStatus'] == 'COMPLETED':
+                    if last is None or ingestion['CreatedTime'] > last:
+                        last = ingestion['CreatedTime']
+        return last
+
+    @boto_safe_run
+    def set_lookback_window(client, hours):
+        """ function that sets dataset lookback window used by incremental refresh. It takes input
+        :param client: Quicksight service client
+        :param hours: size of the lookback window in hours
+        :return: None
+        """
+        client.put_data_set_refresh_properties(
+            AwsAccountId=account_id, DataSetId=dataset_id,
+            DataSetRefreshProperties={'RefreshConfiguration': {'IncrementalRefresh': {'LookbackWindow': {
+                'ColumnName': lookback_column, 'Size': hours, 'SizeUnit': 'HOUR'}}}})
+
+    @boto_safe_run
+    def start_ingestion(client):
+        """ function that starts dataset ingestion. Incremental refresh window covers the time since the last completed
+        ingestion, rounded up to whole hours
+        :param client: Quicksight service client
+        :return: dictionary with ingestion id and ingestion type
+        """
+        ingestion_id = datetime.now(tz=timezone).strftime("%Y-%m-%d_%H%M%S")
+        ingestion_type = 'FULL_REFRESH'
+        if refresh_mode == 'INCREMENTAL':
+            last_time = get_last_ingestion_time(client)
+            if last_time is not None:
+                elapsed = datetime.now(tz=pytz.utc) - last_time.astimezone(pytz.utc)
+                hours = max(1, math.ceil(elapsed.total_seconds() / 3600))
+                set_lookback_window(client, hours)
+                ingestion_type = 'INCREMENTAL_REFRESH'
+                print(f"incremental refresh of {dataset_id}, lookback window {hours} hours")
+        client.create_ingestion(DataSetId=dataset_id, IngestionId=ingestion_id,
+                                AwsAccountId=account_id, IngestionType=ingestion_type)
+        return {"ingestion_id": ingestion_id, "ingestion_type": ingestion_type, "status": "INITIALIZED", "checks": 0}
+
+    def emit_metrics(ingestion, ingestion_type):
+        """ function that prints ingestion indicators in CloudWatch Embedded Metric Format, so they are collected
+        from Lambda logs as CloudWatch metrics
+        :param ingestion: Ingestion object of describe_ingestion response
+        :param ingestion_type: type of the ingestion, used as metric dimension
+        :return: None
+        """
+        row_info = ingestion.get('RowInfo', {})
+        metrics.add("RecordsOut", row_info.get('RowsIngested', 0))
+        metrics.emit({
+            "RowsIngested": (row_info.get('RowsIngested', 0), "Count"),
+            "RowsDropped": (row_info.get('RowsDropped', 0), "Count"),
+            "IngestionTimeInSeconds": (ingestion.get('IngestionTimeInSeconds', 0), "Seconds"),
+            "IngestionSizeInBytes": (ingestion.get('IngestionSizeInBytes', 0), "Bytes"),
+        }, dimensions={"DataSetId": dataset_id, "IngestionType": ingestion_type})
+
+    @boto_safe_run
+    def check_ingestion(client, ingestion_id, ingestion_type, checks):
+        """ function that returns current status of the ingestion. Failed ingestions raise RuntimeError so that
+        Step Functions run fails. It takes input
+        :param client: Quicksight service client
+        :param ingestion_id: id of the ingestion
+        :param ingestion_type: type of the ingestion
+        :param checks: number of previous status checks of the ingestion
+        :return: dictionary with ingestion id, ingestion type, status and number of status checks
+        """
+        response = client.describe_ingestion(DataSetId=dataset_id,
+                                             IngestionId=ingestion_id,
+                                             AwsAccountId=account_id)
+        ingestion = response['Ingestion']
+        status = ingestion['IngestionStatus']
+        if status == 'COMPLETED':
+            print(
+                "refresh completed. RowsIngested {0}, RowsDropped {1}, IngestionTimeInSeconds {2}, IngestionSizeInBytes {3}".format(
+                    ingestion['RowInfo']['RowsIngested'],
+                    ingestion['RowInfo']['RowsDropped'],
+                    ingestion['IngestionTimeInSeconds'],
+                    ingestion['IngestionSizeInBytes']))
+            emit_metrics(ingestion, ingestion_type)
+        elif status not in ('INITIALIZED', 'QUEUED', 'RUNNING'):
+            print("refresh failed for {0}! - status {1}".format(dataset_id, status))
+            # cancelled ingestions have no error info
+            error_info = ingestion.get('ErrorInfo', {})
+            print("Error info: ", error_info.get('Type'))
+            print("Error message: ", error_info.get('Message'))
+            raise RuntimeError(f"Quicksight ingestion {ingestion_id} {status}: {error_info.get('Message')}")
+        return {"ingestion_id": ingestion_id, "ingestion_type": ingestion_type, "status": status, "checks": checks + 1}
+
     # initiate service client
-    client = boto3.client('quicksight')
-    ingestion_id = datetime.now(tz=timezone).strftime("%Y-%m-%d_%H%M%S")
-    # run ingestion job
-    client.create_ingestion(DataSetId=dataset_id, IngestionId=ingestion_id,
-                            AwsAccountId=account_id)
-    # wait for ingestion job is completed
-    while True:
-        try:
-            response = client.describe_ingestion(DataSetId=dataset_id,
-                                                 IngestionId=ingestion_id,
-                                                 AwsAccountId=account_id)
-            if response['Ingestion']['IngestionStatus'] in ('INITIALIZED', 'QUEUED', 'RUNNING'):
-                time.sleep(5)
-            elif response['Ingestion']['IngestionStatus'] == 'COMPLETED':
-                print(
-                    "refresh completed. RowsIngested {0}, RowsDropped {1}, IngestionTimeInSeconds {2}, IngestionSizeInBytes {3}".format(
-                        response['Ingestion']['RowInfo']['RowsIngested'],
-                        response['Ingestion']['RowInfo']['RowsDropped'],
-                        response['Ingestion']['IngestionTimeInSeconds'],
-                        response['Ingestion']['IngestionSizeInBytes']))
-                break
-            else:
-                print("refresh failed for {0}! - status {1}".format(dataset_id, response['Ingestion']['IngestionStatus']))
-                print("Error info: ", response['Ingestion']['ErrorInfo']['Type'])
-                print("Error message: ", response['Ingestion']['ErrorInfo']['Message'])
-                break
-        # boto3 error handling using ClientError and ParamValidationError errors.
-        except ClientError as e:
-            print("Glue client returned error: ", e.response['Error']['Message'])
-            raise e
-        except ParamValidationError as e:
-            raise ValueError(f'The parameters you provided are incorrect: {e}')
-   
-    return json.dumps({"exit_status":"SUCCESS"})
+    client = bootstrap.client('quicksight')
+    event = event or {}
+    if event.get('action', 'start') == 'status':
+        return check_ingestion(client, event['ingestion_id'], event.get('ingestion_type', 'FULL_REFRESH'),
+                               int(event.get('checks', 0)))
+    return start_ingestion(client)
@@ -0,0 +1,17 @@
+""" pytest configuration, Lambda function modules are imported from lambda directory the same way Lambda runtime does,
+in-memory AWS stand-ins and synthetic data generators are imported from benchmarks directory """
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lambda'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks'))
+
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def active_metrics(monkeypatch):
+    # invoked handlers make their metrics active, no-op metrics of the module are restored after every test
+    monkeypatch.setattr(instrumentation, "_active", instrumentation._active)
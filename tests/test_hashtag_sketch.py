@@ -0,0 +1,129 @@
+""" Tests of bounded memory and error bounds of hashtag_sketch summaries on seeded Zipf distributed streams """
+import json
+import random
+from collections import Counter
+
+import pytest
+
+import hashtag_sketch
+
+
+def zipf_stream(n, items=2000, s=1.1, seed=0):
+    # seeded stream of n hashtags whose popularity follows Zipf distribution
+    rnd = random.Random(seed)
+    vocabulary = [f"tag{i}" for i in range(items)]
+    weights = [1 / (rank ** s) for rank in range(1, items + 1)]
+    return rnd.choices(vocabulary, weights, k=n)
+
+
+@pytest.fixture(scope="module")
+def stream():
+    return zipf_stream(20000)
+
+
+@pytest.mark.parametrize("k", [1, 10, 100])
+def test_space_saving_holds_at_most_k_counters(stream, k):
+    summary = hashtag_sketch.SpaceSaving(k)
+    for i, item in enumerate(stream):
+        summary.add(item)
+        if i % 997 == 0:
+            assert len(summary.counters) <= k
+    assert len(summary.counters) <= k
+    assert summary.total == len(stream)
+
+
+def test_space_saving_error_bounds(stream):
+    k = 100
+    summary = hashtag_sketch.SpaceSaving(k)
+    for item in stream:
+        summary.add(item)
+    true_counts = Counter(stream)
+    for item, (count, error, *_) in summary.counters.items():
+        assert count - error <= true_counts[item] <= count
+        assert error <= len(stream) / k
+    # every item with true count above N / k is tracked
+    for item, count in true_counts.items():
+        if count > len(stream) / k:
+            assert item in summary.counters
+
+
+def test_space_saving_merge_keeps_error_bounds(stream):
+    half = len(stream) // 2
+    first, second = hashtag_sketch.SpaceSaving(50), hashtag_sketch.SpaceSaving(50)
+    for item in stream[:half]:
+        first.add(item)
+    for item in stream[half:]:
+        second.add(item)
+    merged = first.merge(second)
+    true_counts = Counter(stream)
+    assert len(merged.counters) <= 50
+    assert merged.total == len(stream)
+    for item, (count, error, *_) in merged.counters.items():
+        assert count - error <= true_counts[item] <= count
+
+
+def test_count_min_never_underestimates_and_is_within_eps(stream):
+    eps, delta = 0.001, 0.01
+    sketch = hashtag_sketch.CountMinSketch(eps, delta)
+    for item in stream:
+        sketch.add(item)
+    true_counts = Counter(stream)
+    within_bound = 0
+    for item, count in true_counts.items():
+        estimate = sketch.estimate(item)
+        assert estimate >= count
+        within_bound += estimate - count <= eps * len(stream)
+    # each estimate exceeds the bound with probability at most delta
+    assert within_bound >= (1 - 2 * delta) * len(true_counts)
+
+
+def test_count_min_merge_equals_sketch_of_whole_stream(stream):
+    half = len(stream) // 2
+    whole, first, second = (hashtag_sketch.CountMinSketch(0.01, 0.01) for _ in range(3))
+    for item in stream:
+        whole.add(item)
+    for item in stream[:half]:
+        first.add(item)
+    for item in stream[half:]:
+        second.add(item)
+    assert first.merge(second).to_dict() == whole.to_dict()
+
+
+def test_count_min_merge_rejects_different_sizes():
+    with pytest.raises(ValueError):
+        hashtag_sketch.CountMinSketch(width=10, depth=2).merge(hashtag_sketch.CountMinSketch(width=20, depth=2))
+
+
+def test_snapshots_round_trip(stream):
+    rollup = hashtag_sketch.HashtagRollup("2020-09-01 10:00:00", k=20, eps=0.01)
+    rnd = random.Random(1)
+    for item in stream[:5000]:
+        rollup.add(item, rnd.uniform(-1, 1), rnd.random())
+    # snapshots are saved as json, so the round trip goes through json text
+    restored = hashtag_sketch.HashtagRollup.from_dict(json.loads(json.dumps(rollup.to_dict())))
+    assert restored.to_dict() == rollup.to_dict()
+    assert restored.rows() == rollup.rows()
+
+    summary = hashtag_sketch.SpaceSaving.from_dict(json.loads(json.dumps(rollup.top_k.to_dict())))
+    assert summary.top() == rollup.top_k.top()
+    sketch = hashtag_sketch.CountMinSketch.from_dict(json.loads(json.dumps(rollup.cms.to_dict())))
+    assert all(sketch.estimate(item) == rollup.cms.estimate(item) for item in set(stream[:5000]))
+
+
+def test_rollup_merge_of_restored_snapshots(stream):
+    bucket = "2020-09-01 10:00:00"
+    first, second, whole = (hashtag_sketch.HashtagRollup(bucket, k=50, eps=0.01) for _ in range(3))
+    half = len(stream) // 2
+    for item in stream[:half]:
+        first.add(item, 0.5, 0.25)
+        whole.add(item, 0.5, 0.25)
+    for item in stream[half:]:
+        second.add(item, 0.5, 0.25)
+        whole.add(item, 0.5, 0.25)
+    merged = hashtag_sketch.HashtagRollup.from_dict(first.to_dict()) \
+        .merge(hashtag_sketch.HashtagRollup.from_dict(second.to_dict()))
+    assert merged.cms.to_dict() == whole.cms.to_dict()
+    assert merged.polarity_sum == pytest.approx(whole.polarity_sum)
+    assert merged.top_k.total == len(stream)
+    with pytest.raises(ValueError):
+        merged.merge(hashtag_sketch.HashtagRollup("2020-09-01 11:00:00"))
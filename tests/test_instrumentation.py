@@ -0,0 +1,124 @@
+""" Tests of CloudWatch Embedded Metric Format records printed by instrumentation module """
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import instrumentation
+
+
+def printed_records(capsys):
+    # EMF records printed to stdout, one json object per line
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.strip()]
+
+
+def test_emf_record_structure():
+    record = instrumentation.emf_record("TestNamespace", {"Stage": "staging-transform"},
+                                        {"RecordsIn": (10, "Count"), "LoadTime": ([1.5, 2.5], "Milliseconds")},
+                                        {"RequestId": "abc"})
+    directive = record["_aws"]["CloudWatchMetrics"]
+    assert isinstance(record["_aws"]["Timestamp"], int)
+    assert directive == [{"Namespace": "TestNamespace",
+                          "Dimensions": [["Stage"]],
+                          "Metrics": [{"Name": "RecordsIn", "Unit": "Count"},
+                                      {"Name": "LoadTime", "Unit": "Milliseconds"}]}]
+    # dimension values, metric values and properties are keys at the root of the record
+    assert record["Stage"] == "staging-transform"
+    assert record["RecordsIn"] == 10
+    assert record["LoadTime"] == [1.5, 2.5]
+    assert record["RequestId"] == "abc"
+
+
+def test_flush_prints_collected_metrics(capsys):
+    metrics = instrumentation.Metrics("test-stage", namespace="TestNamespace", enabled=True)
+    metrics.add("RecordsIn", 3)
+    metrics.add("RecordsIn", 2)
+    metrics.add("BytesRead", 100, "Bytes")
+    metrics.put("SentimentCacheHitRate", 50.0, "Percent")
+    metrics.observe("S3Latency", 12.5)
+    with metrics.timer("LoadTime"):
+        pass
+    metrics.flush()
+    [record] = printed_records(capsys)
+    units = {m["Name"]: m["Unit"] for m in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+    assert units == {"RecordsIn": "Count", "BytesRead": "Bytes", "SentimentCacheHitRate": "Percent",
+                     "S3Latency": "Milliseconds", "LoadTime": "Milliseconds"}
+    assert record["Stage"] == "test-stage"
+    assert record["RecordsIn"] == 5
+    assert record["BytesRead"] == 100
+    assert record["S3Latency"] == [12.5]
+    assert len(record["LoadTime"]) == 1 and record["LoadTime"][0] >= 0
+    # metrics are cleared after flush
+    assert metrics.flush() is None
+    assert printed_records(capsys) == []
+
+
+def test_observe_splits_records_at_max_values(capsys):
+    metrics = instrumentation.Metrics("test-stage", enabled=True)
+    count = instrumentation.MAX_VALUES * 2 + 5
+    for i in range(count):
+        metrics.observe("KinesisLatency", i)
+    early = printed_records(capsys)
+    assert [len(r["KinesisLatency"]) for r in early] == [instrumentation.MAX_VALUES] * 2
+    metrics.flush()
+    [last] = printed_records(capsys)
+    assert last["KinesisLatency"] == list(range(instrumentation.MAX_VALUES * 2, count))
+    assert [v for r in early + [last] for v in r["KinesisLatency"]] == list(range(count))
+
+
+def test_handler_flushes_when_handler_raises(capsys):
+    metrics = instrumentation.Metrics("test-stage", enabled=True)
+
+    @metrics.handler
+    def lambda_handler(event, context):
+        metrics.add("RecordsIn", 7)
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        lambda_handler({}, SimpleNamespace(aws_request_id="request-1"))
+    [record] = printed_records(capsys)
+    assert record["RecordsIn"] == 7
+    assert record["RequestId"] == "request-1"
+    assert len(record["HandlerTime"]) == 1
+    # module level helpers record in metrics of the last invoked handler
+    assert instrumentation.active() is metrics
+
+
+def test_noop_mode_prints_nothing(capsys):
+    metrics = instrumentation.Metrics("test-stage", enabled=False)
+
+    @metrics.handler
+    @metrics.timed("StepTime")
+    def lambda_handler(event, context):
+        metrics.add("RecordsIn", 1)
+        metrics.put("SentimentCacheHitRate", 10.0, "Percent")
+        for i in range(instrumentation.MAX_VALUES + 1):
+            metrics.observe("S3Latency", i)
+        with metrics.timer("LoadTime"):
+            pass
+        return "done"
+
+    assert lambda_handler({}, None) == "done"
+    assert metrics.emit({"RowsIngested": (1, "Count")}) is None
+    assert metrics.timer("LoadTime") is instrumentation._null_timer
+    assert capsys.readouterr().out == ""
+
+
+def test_metrics_mode_environment(monkeypatch):
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    monkeypatch.delenv("METRICS_MODE", raising=False)
+    assert not instrumentation.metrics_enabled()
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "staging-transform")
+    assert instrumentation.metrics_enabled()
+    monkeypatch.setenv("METRICS_MODE", "off")
+    assert not instrumentation.metrics_enabled()
+
+
+def test_emit_uses_own_dimensions(capsys):
+    metrics = instrumentation.Metrics("update-quicksight-dataset", enabled=True)
+    metrics.emit({"RowsIngested": (42, "Count")}, dimensions={"DataSetId": "ds", "IngestionType": "FULL_REFRESH"})
+    [record] = printed_records(capsys)
+    assert record["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["DataSetId", "IngestionType"]]
+    assert record["DataSetId"] == "ds" and record["IngestionType"] == "FULL_REFRESH"
+    assert "Stage" not in record
+    assert record["RowsIngested"] == 42
@@ -0,0 +1,130 @@
+""" Tests of staging-transform Lambda handlers run against in-memory AWS stand-ins of benchmarks/aws_fakes.py """
+import json
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+import pytest
+
+import aws_fakes
+import bootstrap
+from transform_scaling import LANDING_COLS, STAGING_COLS, load_handler, make_landing_frame
+
+BUCKET = "tweet-etl"
+ENVIRONMENT = {
+    "ACCOUNT_ID": "123456789012", "BUCKET_NAME": BUCKET, "TIME_ZONE": "UTC", "TIME_HORIZONT_HRS": "1",
+    "SOURCE_DB": "landing", "SOURCE_TABLE": "tweets", "TARGET_DB": "staging", "TARGET_TABLE": "hashtags_proc",
+    "LANDING_PATH": "landing/", "STAGING_PATH": "staging/hashtags_proc/", "STAGING_FILE": "hashtags_proc",
+    "ROLLUP_PATH": "analytical/hashtag_rollup/",
+}
+
+
+class Clock(datetime):
+    # datetime whose now() is shifted by offset, so that consecutive runs get different run ids
+    offset = timedelta(0)
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz) + cls.offset
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ("AWS_LAMBDA_FUNCTION_NAME", "CONFIG_TABLE", "DDB_TABLE", "CONFIG_ITEM"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in ENVIRONMENT.items():
+        monkeypatch.setenv(name, value)
+    # install() replaces bootstrap functions, they are restored after the test
+    monkeypatch.setattr(bootstrap, "client", bootstrap.client)
+    monkeypatch.setattr(bootstrap, "resource", bootstrap.resource)
+    s3 = aws_fakes.FakeS3()
+    glue = aws_fakes.FakeGlue({("landing", "tweets"): (LANDING_COLS, []),
+                               ("staging", "hashtags_proc"): (STAGING_COLS[:-3], STAGING_COLS[-3:])})
+    aws_fakes.install({"s3": s3, "glue": glue})
+    return s3
+
+
+@pytest.fixture
+def staging(s3, monkeypatch):
+    module = load_handler('staging-transform')
+    Clock.offset = timedelta(0)
+    monkeypatch.setattr(module, "datetime", Clock)
+    return module
+
+
+def put_landing_file(s3, staging, name, rows, seed):
+    # landing file of the current day, in the format kinesis-consumer-s3 saves it
+    day = Clock.now(timezone.utc).strftime("%Y-%m-%d")
+    buffer = StringIO()
+    make_landing_frame(staging.pd, rows, seed).to_csv(buffer, header=False, index=False)
+    key = staging.get_prefix(ENVIRONMENT["LANDING_PATH"], day) + name
+    s3.put_object(Bucket=BUCKET, Key=key, Body=buffer.getvalue())
+    return key
+
+
+def age_object(s3, key, hours):
+    # moves LastModified of the object back, so it falls out of the time window of the next run
+    data, modified = s3.objects[(BUCKET, key)]
+    s3.objects[(BUCKET, key)] = (data, modified - timedelta(hours=hours))
+
+
+def rollup_total(s3):
+    # number of hashtag rows counted in all sketch snapshots
+    snapshot_path = ENVIRONMENT["ROLLUP_PATH"].rstrip('/') + '_snapshots/'
+    return sum(bucket["top_k"]["total"] for key in s3.keys(BUCKET, snapshot_path)
+               for bucket in json.loads(s3.objects[(BUCKET, key)][0]))
+
+
+def test_rollups_of_two_windows_of_the_same_day_cover_both(s3, staging):
+    first = put_landing_file(s3, staging, "tweets-1.csv", 200, seed=1)
+    rows_first = int(staging.lambda_handler({}, None).split(",")[2])
+    age_object(s3, first, 2)
+    put_landing_file(s3, staging, "tweets-2.csv", 300, seed=2)
+    Clock.offset = timedelta(seconds=1)
+    rows_second = int(staging.lambda_handler({}, None).split(",")[2])
+    assert rows_first > 0 and rows_second > 0
+    assert len(s3.keys(BUCKET, ENVIRONMENT["ROLLUP_PATH"] + "hashtag_rollup_")) == 2
+    assert rollup_total(s3) == rows_first + rows_second
+
+
+def test_backfill_replaces_rollups_of_the_day(s3, staging):
+    first = put_landing_file(s3, staging, "tweets-1.csv", 200, seed=1)
+    staging.lambda_handler({}, None)
+    age_object(s3, first, 2)
+    put_landing_file(s3, staging, "tweets-2.csv", 300, seed=2)
+    day = Clock.now(timezone.utc).strftime("%Y-%m-%d")
+    result = staging.backfill_handler({"day": day}, None)
+    assert s3.keys(BUCKET, ENVIRONMENT["ROLLUP_PATH"] + "hashtag_rollup_") == \
+        [ENVIRONMENT["ROLLUP_PATH"] + "hashtag_rollup_" + day + ".csv"]
+    assert rollup_total(s3) == int(result["values"].split(",")[2])
+
+
+def test_fanout_plan_of_day_without_landing_files(s3, staging):
+    fanout = staging.fanout_handler({"action": "plan", "workers": 4}, None)
+    assert fanout["slices"] == []
+    plan = staging.load_plan(s3, staging.load_settings(), fanout["run_id"])
+    assert plan["slices"] == []
+    log_record = staging.fanout_handler({"action": "merge", "run_id": fanout["run_id"]}, None)
+    assert int(log_record.split(",")[2]) == 0
+    assert int(staging.fanout_handler({"action": "local"}, None).split(",")[2]) == 0
+
+
+def test_fanout_plan_lists_more_than_one_page_of_landing_files(s3, staging):
+    prefix = staging.get_prefix(ENVIRONMENT["LANDING_PATH"], Clock.now(timezone.utc).strftime("%Y-%m-%d"))
+    keys = [prefix + f"tweets-{i:05d}.csv" for i in range(2500)]
+    for key in keys:
+        s3.put_object(Bucket=BUCKET, Key=key, Body="")
+    age_object(s3, keys[0], 2)
+    fanout = staging.fanout_handler({"action": "plan", "workers": 4}, None)
+    plan = staging.load_plan(s3, staging.load_settings(), fanout["run_id"])
+    assert len(plan["slices"]) == 4
+    # files out of the time window are not planned
+    assert [k for part in plan["slices"] for k in part] == keys[1:]
+
+
+def test_window_of_empty_landing_files(s3, staging):
+    prefix = staging.get_prefix(ENVIRONMENT["LANDING_PATH"], Clock.now(timezone.utc).strftime("%Y-%m-%d"))
+    s3.put_object(Bucket=BUCKET, Key=prefix + "tweets-1.csv", Body="")
+    s3.put_object(Bucket=BUCKET, Key=prefix + "tweets-2.csv", Body="")
+    assert int(staging.lambda_handler({}, None).split(",")[2]) == 0
+    assert int(staging.fanout_handler({"action": "local", "workers": 2}, None).split(",")[2]) == 0
+    assert s3.keys(BUCKET, ENVIRONMENT["ROLLUP_PATH"]) == []